@@ -0,0 +1,24 @@
+"""Cache backends of the project."""
+import itertools
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class SessionFileCache(FileBasedCache):
+    """
+    File cache for sessions that culls on one write in `cull_every`.
+
+    FileBasedCache lists its whole directory before every write to decide
+    whether to cull, a cost paid on every login. Sessions cached in front
+    of the database are read back from it once culled, so the directory
+    may safely grow a little past MAX_ENTRIES between two culls.
+    """
+    cull_every = 100
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._writes = itertools.count()
+
+    def _cull(self):
+        if next(self._writes) % self.cull_every == 0:
+            super()._cull()
@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 from decouple import config, Csv
 
+from mysite.database import database_config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -51,24 +53,47 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Record query count and timings of every request, see polls:metrics
+POLLS_INSTRUMENTATION = config('POLLS_INSTRUMENTATION', cast=bool,
+                               default=True)
+# Requests slower than this many milliseconds are logged
+POLLS_REQUEST_BUDGET_MS = config('POLLS_REQUEST_BUDGET_MS', cast=float,
+                                 default=500)
+if POLLS_INSTRUMENTATION:
+    MIDDLEWARE.insert(0, 'polls.middleware.InstrumentationMiddleware')
+
 ROOT_URLCONF = 'mysite.urls'
 
+BASE_TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'polls.fragments.fragment_cache',
+            ],
+            # compile each template once per process, the development
+            # server still reloads templates that changed on disk
+            'loaders': [
+                ('django.template.loaders.cached.Loader', BASE_TEMPLATE_LOADERS),
             ],
         },
     },
 ]
 
+# Seconds to keep cached template fragments such as the page header
+POLLS_FRAGMENT_CACHE_TIMEOUT = config('POLLS_FRAGMENT_CACHE_TIMEOUT', cast=int,
+                                      default=300)
+
 WSGI_APPLICATION = 'mysite.wsgi.application'
 
 
@@ -80,14 +105,127 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 
+# DATABASE_URL selects the primary database, DATABASE_REPLICA_URLS lists
+# optional read replicas that serve the reads of the polls app.
+CONN_MAX_AGE = config('CONN_MAX_AGE', cast=int, default=60)
+
 DATABASES = {
+    'default': database_config(
+        config('DATABASE_URL', cast=str, default='sqlite:///db.sqlite3'),
+        base_dir=BASE_DIR, conn_max_age=CONN_MAX_AGE,
+        conn_health_checks=True,
+    ),
+}
+
+for number, replica_url in enumerate(
+        config('DATABASE_REPLICA_URLS', cast=Csv(), default=''), start=1):
+    DATABASES[f'replica{number}'] = database_config(
+        replica_url, base_dir=BASE_DIR, conn_max_age=CONN_MAX_AGE,
+        conn_health_checks=True,
+    )
+    # replicas are copies of the primary, tests use the primary for both
+    DATABASES[f'replica{number}']['TEST'] = {'MIRROR': 'default'}
+
+POLLS_REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+
+# How reads are spread over the replicas: 'round-robin' or 'least-recent'
+POLLS_REPLICA_POLICY = config('POLLS_REPLICA_POLICY', cast=str,
+                              default='round-robin')
+# After a write, the client reads from the primary for this many seconds
+POLLS_REPLICA_PIN_SECONDS = config('POLLS_REPLICA_PIN_SECONDS', cast=int,
+                                   default=5)
+POLLS_REPLICA_PIN_COOKIE = 'polls_primary'
+
+DATABASE_ROUTERS = []
+if POLLS_REPLICA_DATABASES:
+    DATABASE_ROUTERS.append('polls.routers.ReplicaRouter')
+    MIDDLEWARE.insert(1, 'polls.middleware.ReplicaPinningMiddleware')
+
+# Tuning applied to every new SQLite connection: WAL journal, relaxed
+# fsync, a busy timeout instead of immediate lock errors and memory mapping.
+SQLITE_PRAGMAS = {
+    'journal_mode': config('SQLITE_JOURNAL_MODE', cast=str, default='wal'),
+    'synchronous': config('SQLITE_SYNCHRONOUS', cast=str, default='normal'),
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', cast=int, default=5000),
+    'mmap_size': config('SQLITE_MMAP_SIZE', cast=int, default=134217728),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': config('CACHE_BACKEND', cast=str,
+                          default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', cast=str, default='ku-polls'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', cast=int, default=1000),
+            'CULL_FREQUENCY': config('CACHE_CULL_FREQUENCY', cast=int, default=3),
+        },
+    },
+    # kept apart from 'default' so culling poll results never drops sessions,
+    # and in files shared by every worker so a logout ends the session in all
+    'sessions': {
+        'BACKEND': config('SESSION_CACHE_BACKEND', cast=str,
+                          default='mysite.cache.SessionFileCache'),
+        'LOCATION': config('SESSION_CACHE_LOCATION', cast=str,
+                           default=str(BASE_DIR / 'cache' / 'sessions')),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('SESSION_CACHE_MAX_ENTRIES', cast=int,
+                                  default=10000),
+        },
+    },
 }
 
 
+# Seconds to keep the results of a poll cached, votes invalidate it earlier
+POLLS_RESULTS_CACHE_TIMEOUT = config('POLLS_RESULTS_CACHE_TIMEOUT', cast=int,
+                                     default=300)
+
+
+# Sessions and messages
+# https://docs.djangoproject.com/en/4.2/topics/http/sessions/
+# cached_db reads sessions from the cache and only writes them through to
+# the database, cache keeps them in the cache alone. Messages live in a
+# signed cookie so showing a message never writes the session.
+
+SESSION_ENGINE = config('SESSION_ENGINE', cast=str,
+                        default='django.contrib.sessions.backends.cached_db')
+SESSION_CACHE_ALIAS = 'sessions'
+
+MESSAGE_STORAGE = config('MESSAGE_STORAGE', cast=str,
+                         default='django.contrib.messages.storage.cookie.CookieStorage')
+
+
+# Number of questions on each page of the poll index
+POLLS_INDEX_PAGE_SIZE = config('POLLS_INDEX_PAGE_SIZE', cast=int, default=10)
+# Number of best matches shown for a search of the poll index
+POLLS_SEARCH_RESULTS = config('POLLS_SEARCH_RESULTS', cast=int, default=50)
+
+
+# Queue votes in process and write them in batches from a background worker
+POLLS_VOTE_WRITE_BEHIND = config('POLLS_VOTE_WRITE_BEHIND', cast=bool,
+                                 default=False)
+POLLS_VOTE_BATCH_SIZE = config('POLLS_VOTE_BATCH_SIZE', cast=int, default=500)
+POLLS_VOTE_FLUSH_INTERVAL = config('POLLS_VOTE_FLUSH_INTERVAL', cast=float,
+                                   default=0.5)
+POLLS_VOTE_QUEUE_SIZE = config('POLLS_VOTE_QUEUE_SIZE', cast=int,
+                               default=10000)
+
+
+# Live results streams (Server-Sent Events, served under ASGI): reload the
+# results of a watched poll at most this many times per second, send a
+# keepalive after this many idle seconds and end a stream after this many
+# seconds (browsers reconnect by themselves)
+POLLS_STREAM_MAX_RATE = config('POLLS_STREAM_MAX_RATE', cast=float, default=2)
+POLLS_STREAM_KEEPALIVE = config('POLLS_STREAM_KEEPALIVE', cast=float,
+                                default=15)
+POLLS_STREAM_MAX_AGE = config('POLLS_STREAM_MAX_AGE', cast=float, default=300)
+
+POLLS_ROLLUP_LAG = config('POLLS_ROLLUP_LAG', cast=float, default=5)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -106,6 +244,35 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# https://docs.djangoproject.com/en/4.2/topics/auth/passwords/
+# PASSWORD_HASHER_PROFILE picks the hasher of new passwords: 'pbkdf2',
+# 'scrypt', 'argon2' (needs argon2-cffi) or 'fast' for tests and benchmarks
+# only. The other hashers still verify passwords hashed before a change.
+
+PASSWORD_HASHER_PROFILE = config('PASSWORD_HASHER_PROFILE', cast=str,
+                                 default='pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = config('PASSWORD_PBKDF2_ITERATIONS', cast=int,
+                                    default=600000)
+PASSWORD_SCRYPT_WORK_FACTOR = config('PASSWORD_SCRYPT_WORK_FACTOR', cast=int,
+                                     default=2 ** 14)
+PASSWORD_ARGON2_TIME_COST = config('PASSWORD_ARGON2_TIME_COST', cast=int,
+                                   default=2)
+PASSWORD_ARGON2_MEMORY_COST = config('PASSWORD_ARGON2_MEMORY_COST', cast=int,
+                                     default=102400)
+
+PASSWORD_HASHER_PROFILES = {
+    'pbkdf2': 'polls.hashers.TunablePBKDF2PasswordHasher',
+    'scrypt': 'polls.hashers.TunableScryptPasswordHasher',
+    'argon2': 'polls.hashers.TunableArgon2PasswordHasher',
+    'fast': 'django.contrib.auth.hashers.MD5PasswordHasher',
+}
+
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]] + [
+    hasher for profile, hasher in PASSWORD_HASHER_PROFILES.items()
+    if profile not in (PASSWORD_HASHER_PROFILE, 'fast')
+]
+
 # Where to redirect visitor after login or logout
 LOGIN_REDIRECT_URL = 'polls:index'  # after login, show list of polls
 LOGOUT_REDIRECT_URL = 'login'       # after logout, direct to where?
@@ -127,6 +294,25 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+STATIC_ROOT = config('STATIC_ROOT', cast=Path, default=BASE_DIR / 'staticfiles')
+
+# Fingerprint and precompress static files at collectstatic time, and let
+# Django serve them with long-lived cache headers when no web server does.
+STATICFILES_MANIFEST = config('STATICFILES_MANIFEST', cast=bool,
+                              default=not DEBUG)
+SERVE_STATIC = config('SERVE_STATIC', cast=bool, default=False)
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': ('polls.storage.CompressedManifestStaticFilesStorage'
+                    if STATICFILES_MANIFEST else
+                    'django.contrib.staticfiles.storage.StaticFilesStorage'),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,31 @@
+"""
+Settings for running the test suite quickly:
+
+    python manage.py test polls --settings=mysite.test_settings --parallel
+
+Tests run against an in-memory SQLite database whatever DATABASE_URL
+says, and hash passwords with MD5 since the tests never need a password
+that is expensive to guess.
+"""
+from mysite.settings import *  # noqa: F401,F403
+from mysite.settings import PASSWORD_HASHER_PROFILES, PASSWORD_HASHERS
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+DATABASE_ROUTERS = []
+POLLS_REPLICA_DATABASES = []
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE  # noqa: F405
+              if middleware != 'polls.middleware.ReplicaPinningMiddleware']
+
+# each test process keeps its sessions to itself
+CACHES = {**CACHES, 'sessions': {  # noqa: F405
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'ku-polls-sessions',
+}}
+
+# the tunable hashers stay available for the tests that exercise them
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES['fast']] + PASSWORD_HASHERS
@@ -14,10 +14,11 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 from django.views.generic import RedirectView
-from polls import views
+from polls import staticserve, views
 
 urlpatterns = [
     path('', RedirectView.as_view(url='polls/')),
@@ -25,4 +26,10 @@ urlpatterns = [
     path('accounts/', include('django.contrib.auth.urls')),
     path('signup/', views.signup, name='signup'),
     path('admin/', admin.site.urls),
-]
\ No newline at end of file
+]
+
+if settings.SERVE_STATIC:
+    urlpatterns.append(
+        path(f'{settings.STATIC_URL.strip("/")}/<path:path>',
+             staticserve.serve, name='static')
+    )
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
 from .models import Choice, Question
+from .reports import export_response
+from .search import search_questions
 
 
 class ChoiceInline(admin.TabularInline):
@@ -13,11 +15,28 @@ class QuestionAdmin(admin.ModelAdmin):
         (None,               {'fields': ['question_text']}),
         ('Date information', {'fields': ['pub_date', 'end_date'],
                               'classes': ['collapse']}),
+        ('Vote counting',    {'fields': ['tally_shards'],
+                              'classes': ['collapse']}),
     ]
     inlines = [ChoiceInline]
     list_display = ('question_text', 'pub_date', 'was_published_recently')
     list_filter = ['pub_date']
     search_fields = ['question_text']
+    actions = ['export_results_csv', 'export_results_json']
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search the full-text index instead of LIKE over every row."""
+        if not search_term.strip():
+            return queryset, False
+        return search_questions(queryset, search_term), False
+
+    @admin.action(description="Export tallies and votes as CSV")
+    def export_results_csv(self, request, queryset):
+        return export_response(request, queryset.values('pk'), 'csv')
+
+    @admin.action(description="Export tallies and votes as JSON")
+    def export_results_json(self, request, queryset):
+        return export_response(request, queryset.values('pk'), 'json')
 
 
 admin.site.register(Question, QuestionAdmin)
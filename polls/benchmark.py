@@ -0,0 +1,219 @@
+"""
+Query-count and latency benchmark of the polls views.
+
+The benchmark seeds synthetic polls modelled on the fixtures in ``data/``
+and drives the views through the Django test client, recording the number
+of queries and the latency of every request.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .models import Choice, Question, Vote
+
+FIXTURE = settings.BASE_DIR / 'data' / 'polls.json'
+PASSWORD = 'Benchmark-Pass-123'
+BATCH_SIZE = 1000
+
+
+def load_templates(path=FIXTURE):
+    """Return the question texts and choice texts of a fixture file."""
+    with open(path) as fixture:
+        objects = json.load(fixture)
+    questions = [obj['fields']['question_text'] for obj in objects
+                 if obj['model'] == 'polls.question']
+    choices = [obj['fields']['choice_text'] for obj in objects
+               if obj['model'] == 'polls.choice']
+    return questions, choices
+
+
+def seed(questions=100, choices=4, users=100, votes=1000, seed=0):
+    """
+    Create `questions` published questions with `choices` choices each,
+    `users` users sharing one password and up to `votes` votes, at most
+    one per user and question. Return the created users.
+    """
+    rng = random.Random(seed)
+    question_texts, choice_texts = load_templates()
+    Question.objects.bulk_create(
+        [Question(question_text=f"{rng.choice(question_texts)} #{n}")
+         for n in range(questions)],
+        batch_size=BATCH_SIZE,
+    )
+    question_ids = list(Question.objects.values_list('pk', flat=True))
+    Choice.objects.bulk_create(
+        [Choice(question_id=question_id, choice_text=rng.choice(choice_texts))
+         for question_id in question_ids for _ in range(choices)],
+        batch_size=BATCH_SIZE,
+    )
+    choices_of = {}
+    for choice_id, question_id in Choice.objects.values_list('pk',
+                                                             'question_id'):
+        choices_of.setdefault(question_id, []).append(choice_id)
+
+    # hash once, hashing every user would dominate the seeding time
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        [User(username=f"bench{n}", password=password) for n in range(users)],
+        batch_size=BATCH_SIZE,
+    )
+    user_ids = list(User.objects.filter(
+        username__startswith='bench').values_list('pk', flat=True))
+
+    pairs = itertools.product(user_ids, question_ids)
+    votes = min(votes, len(user_ids) * len(question_ids))
+    wanted = set(rng.sample(range(len(user_ids) * len(question_ids)), votes))
+    new_votes = (Vote(user_id=user_id, question_id=question_id,
+                      choice_id=rng.choice(choices_of[question_id]))
+                 for index, (user_id, question_id) in enumerate(pairs)
+                 if index in wanted and choices_of.get(question_id))
+    while batch := list(itertools.islice(new_votes, BATCH_SIZE)):
+        Vote.objects.bulk_create(batch)
+    Choice.objects.recount_votes()
+    return user_ids
+
+
+def percentile(samples, percent):
+    """Return the nearest-rank percentile of sorted `samples`."""
+    if not samples:
+        return 0.0
+    rank = max(1, round(percent / 100 * len(samples)))
+    return samples[min(rank, len(samples)) - 1]
+
+
+def summarize(latencies, query_counts, elapsed):
+    """Return the statistics of one endpoint."""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'queries_min': min(query_counts),
+        'queries_max': max(query_counts),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0,
+    }
+
+
+def measure(make_request, count):
+    """Run `make_request` `count` times and return its statistics."""
+    latencies = []
+    query_counts = []
+    started = time.perf_counter()
+    for n in range(count):
+        with CaptureQueriesContext(connection) as queries:
+            request_started = time.perf_counter()
+            response = make_request(n)
+            latencies.append(time.perf_counter() - request_started)
+        if response.status_code >= 400:
+            raise RuntimeError(f"Request failed with status "
+                               f"{response.status_code}.")
+        query_counts.append(len(queries))
+    return summarize(latencies, query_counts, time.perf_counter() - started)
+
+
+def run_benchmark(requests=100, seed=0, only=None):
+    """
+    Drive the polls endpoints, or those named in `only`, `requests` times
+    each against the seeded data and return their statistics keyed by
+    URL name.
+    """
+    rng = random.Random(seed)
+    question_ids = list(Question.objects.values_list('pk', flat=True))
+    choices = list(Choice.objects.values_list('pk', 'question_id'))
+    voter = User.objects.filter(username__startswith='bench').first()
+    if not question_ids or not choices or voter is None:
+        raise ValueError("Seed the database before running the benchmark.")
+
+    anonymous = Client()
+    member = Client()
+    member.force_login(voter)
+
+    def vote(n):
+        choice_id, question_id = rng.choice(choices)
+        return member.post(reverse('polls:vote', args=(question_id,)),
+                           {'choice': choice_id})
+
+    def signup(n):
+        username = f"signup{seed}x{n}"
+        return Client().post(reverse('signup'), {
+            'username': username,
+            'password1': PASSWORD,
+            'password2': PASSWORD,
+        })
+
+    endpoints = {
+        'polls:index': lambda n: anonymous.get(reverse('polls:index')),
+        'polls:detail': lambda n: member.get(
+            reverse('polls:detail', args=(rng.choice(question_ids),))),
+        'polls:results': lambda n: anonymous.get(
+            reverse('polls:results', args=(rng.choice(question_ids),))),
+        'polls:vote': vote,
+        'signup': signup,
+    }
+    # static files are not benchmarked, so no collectstatic manifest needed
+    storages = {**settings.STORAGES, 'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    }}
+    with override_settings(ALLOWED_HOSTS=['testserver'], STORAGES=storages):
+        return {name: measure(make_request, requests)
+                for name, make_request in endpoints.items()
+                if not only or name in only}
+
+
+def vote_storm(choice, voters, threads=8):
+    """
+    Cast a vote for `choice` by each of `voters` from `threads` threads
+    at once and return the throughput. SQLite writes one transaction at a
+    time and fails the others as locked, those votes are retried.
+    """
+    shares = [voters[n::threads] for n in range(threads)]
+    retries = [0] * threads
+    errors = []
+    barrier = threading.Barrier(threads + 1)
+
+    def cast(n):
+        try:
+            barrier.wait()
+            for user in shares[n]:
+                while True:
+                    try:
+                        Vote.objects.cast(user, choice)
+                        break
+                    except OperationalError as error:
+                        if 'locked' not in str(error):
+                            raise
+                        retries[n] += 1
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=cast, args=(n,))
+               for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        raise errors[0]
+    return {
+        'threads': threads,
+        'votes': len(voters),
+        'seconds': round(elapsed, 3),
+        'votes_per_second': round(len(voters) / elapsed, 1),
+        'retries': sum(retries),
+    }
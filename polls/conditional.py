@@ -0,0 +1,179 @@
+"""
+ETag and Last-Modified of the index and results pages.
+
+The validators are computed from Question.updated_at, which changes
+whenever a question or its votes change, or from the cached results, so
+an unchanged page can be answered with 304 Not Modified before rendering
+or counting anything.
+"""
+import datetime
+import hashlib
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .fragments import question_list_version
+from .models import Question
+from .results import cached_question_results, cached_results_by_id
+
+
+def _has_messages(request):
+    """Return True if the response must show pending messages."""
+    # len() does not mark the messages as seen
+    return len(get_messages(request)) > 0
+
+
+def _viewer(request):
+    """Return a tag of who is viewing, since the page header shows it."""
+    return request.user.pk if request.user.is_authenticated else 0
+
+
+def results_question(request, pk):
+    """
+    Return question `pk`, or None if it does not exist, loading it once
+    per request so the view can reuse it after the validators.
+    """
+    if not hasattr(request, '_polls_question'):
+        request._polls_question = Question.objects.filter(pk=pk).first()
+    return request._polls_question
+
+
+async def aresults_question(request, pk):
+    """Async version of results_question()."""
+    if not hasattr(request, '_polls_question'):
+        request._polls_question = await Question.objects.filter(
+            pk=pk).afirst()
+    return request._polls_question
+
+
+def _digest(results):
+    """Return a digest of the content of some results."""
+    content = json.dumps(results, sort_keys=True).encode()
+    return hashlib.sha1(content).hexdigest()
+
+
+def results_etag(request, pk):
+    """
+    Return the ETag of the results page of question `pk`. Votes for a
+    sharded question leave updated_at alone, so its ETag is a digest of
+    the cached results instead.
+    """
+    question = results_question(request, pk)
+    if question is None or _has_messages(request):
+        return None
+    if question.sharded:
+        version = _digest(cached_question_results(question))
+    else:
+        version = question.updated_at.timestamp()
+    return f'"results-{pk}-{version}-{_viewer(request)}"'
+
+
+def results_last_modified(request, pk):
+    """Return the Last-Modified time of the results page of question `pk`."""
+    question = results_question(request, pk)
+    if question is None or question.sharded or _has_messages(request):
+        return None
+    return question.updated_at
+
+
+def json_results(request, pk):
+    """
+    Return the results of question `pk` for the JSON endpoint, from the
+    cache when possible, or None if the question does not exist.
+    """
+    if not hasattr(request, '_polls_results'):
+        request._polls_results = cached_results_by_id(pk)
+    return request._polls_results
+
+
+def results_json_etag(request, pk):
+    """Return the ETag of the JSON results, a digest of their content."""
+    results = json_results(request, pk)
+    if results is None:
+        return None
+    return f'"results-json-{_digest(results)}"'
+
+
+def _index_markers(request):
+    """
+    Return the latest change, publication and closing among the questions,
+    plus their count, in a single query.
+    """
+    if not hasattr(request, '_polls_index_markers'):
+        now = timezone.now()
+        request._polls_index_markers = Question.objects.aggregate(
+            changed=Max('updated_at'),
+            published=Max('pub_date', filter=Q(pub_date__lte=now)),
+            closed=Max('end_date', filter=Q(end_date__lte=now)),
+            count=Count('pk'),
+        )
+    return request._polls_index_markers
+
+
+def index_last_modified(request):
+    """Return the Last-Modified time of the poll index."""
+    if _has_messages(request):
+        return None
+    markers = _index_markers(request)
+    times = [markers[key] for key in ('changed', 'published', 'closed')
+             if markers[key] is not None]
+    return max(times, default=None)
+
+
+def index_etag(request):
+    """Return the ETag of one page of the poll index."""
+    if _has_messages(request):
+        return None
+    markers = _index_markers(request)
+    parts = [markers['count']] + [
+        markers[key].timestamp() if markers[key] else ''
+        for key in ('changed', 'published', 'closed')
+    ] + [question_list_version(), _viewer(request),
+         request.GET.urlencode()]
+    return '"index-{}"'.format(
+        hashlib.sha1(repr(parts).encode()).hexdigest())
+
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """
+    Async version of django.views.decorators.http.condition, for async
+    views. The validators are sync and run together in the sync thread.
+    """
+    def validators(request, *args, **kwargs):
+        etag = last_modified = None
+        if etag_func:
+            etag = etag_func(request, *args, **kwargs)
+        if last_modified_func:
+            last_modified = last_modified_func(request, *args, **kwargs)
+        return etag, last_modified
+
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag, last_modified = await sync_to_async(validators)(
+                request, *args, **kwargs)
+            if etag is not None:
+                etag = quote_etag(etag)
+            if last_modified:
+                if not timezone.is_aware(last_modified):
+                    last_modified = timezone.make_aware(last_modified,
+                                                        datetime.timezone.utc)
+                last_modified = int(last_modified.timestamp())
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
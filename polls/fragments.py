@@ -0,0 +1,26 @@
+"""Versions that key the cached template fragments of the polls pages."""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+QUESTION_LIST_VERSION_KEY = 'polls:question_list_version'
+
+
+def question_list_version():
+    """Return the current version of the cached question list fragments."""
+    return cache.get_or_set(QUESTION_LIST_VERSION_KEY,
+                            lambda: uuid.uuid4().hex, None)
+
+
+def expire_question_list():
+    """
+    Start a new version of the question list fragments. A random version
+    cannot collide with fragments cached before the old one was evicted.
+    """
+    cache.set(QUESTION_LIST_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def fragment_cache(request):
+    """Context processor with the timeout of cached template fragments."""
+    return {'fragment_cache_timeout': settings.POLLS_FRAGMENT_CACHE_TIMEOUT}
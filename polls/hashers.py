@@ -0,0 +1,37 @@
+"""
+Password hashers whose cost is read from the settings, so the hashing
+cost can be tuned per deployment without changing the stored algorithm
+names. Existing hashes with another cost are upgraded on the next login.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import (Argon2PasswordHasher,
+                                         PBKDF2PasswordHasher,
+                                         ScryptPasswordHasher)
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2 with PASSWORD_PBKDF2_ITERATIONS iterations."""
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class TunableScryptPasswordHasher(ScryptPasswordHasher):
+    """Scrypt with a PASSWORD_SCRYPT_WORK_FACTOR work factor."""
+
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+
+class TunableArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2 with PASSWORD_ARGON2_TIME_COST and PASSWORD_ARGON2_MEMORY_COST."""
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
@@ -0,0 +1,213 @@
+"""
+Write-behind ingestion of votes.
+
+Votes are validated by the view, queued in process and written by a
+background worker in batches, so a burst of votes costs a few bulk
+upserts instead of one write transaction per request.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+
+from .models import Choice, Question, Vote
+from .signals import expire_results
+
+logger = logging.getLogger(__name__)
+
+
+class VoteQueue:
+    """In-process queue of votes flushed to the database in batches."""
+
+    def __init__(self, batch_size=500, flush_interval=0.5, max_size=10000,
+                 autostart=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.autostart = autostart
+        self._queue = queue.Queue(maxsize=max_size)
+        # votes that could not be written yet, retried first in order
+        self._retry = deque()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._exit_hook = False
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        """Create a queue configured by the POLLS_VOTE_* settings."""
+        return cls(batch_size=settings.POLLS_VOTE_BATCH_SIZE,
+                   flush_interval=settings.POLLS_VOTE_FLUSH_INTERVAL,
+                   max_size=settings.POLLS_VOTE_QUEUE_SIZE)
+
+    @property
+    def depth(self):
+        """Return the number of votes waiting to be written."""
+        return self._queue.qsize() + len(self._retry)
+
+    def submit(self, user_id, question_id, choice_id):
+        """
+        Queue a validated vote. Return False if the queue is full or
+        shutting down, in which case the caller must write it itself.
+        """
+        if self._stopping.is_set():
+            return False
+        try:
+            self._queue.put_nowait((user_id, question_id, choice_id))
+        except queue.Full:
+            return False
+        if self.autostart:
+            self.start()
+        return True
+
+    def start(self):
+        """Start the background worker if it is not running yet."""
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._stopping.clear()
+                self._worker = threading.Thread(target=self._run,
+                                                name='polls-vote-queue',
+                                                daemon=True)
+                self._worker.start()
+                if not self._exit_hook:
+                    atexit.register(self.stop)
+                    self._exit_hook = True
+
+    def stop(self):
+        """Stop the worker and write every vote still in the queue."""
+        self._stopping.set()
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+        self.flush()
+        if self._retry:
+            logger.error("Lost %d queued votes that could not be written.",
+                         len(self._retry))
+
+    def flush(self):
+        """Write all queued votes in batches. Return the number written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take(self.batch_size)
+                if not batch:
+                    return written
+                started = time.perf_counter()
+                try:
+                    self._write(batch)
+                except Exception:
+                    self.failures += 1
+                    logger.exception("Could not write %d queued votes, "
+                                     "writing them one at a time.", len(batch))
+                    written += self._write_each(batch)
+                    if self._retry:
+                        # the database is failing, try again next flush
+                        return written
+                    continue
+                elapsed = (time.perf_counter() - started) * 1000
+                self.flushes += 1
+                self.flushed += len(batch)
+                self.last_flush_ms = elapsed
+                self.max_flush_ms = max(self.max_flush_ms, elapsed)
+                written += len(batch)
+
+    def metrics(self):
+        """Return the queue depth and flush statistics."""
+        return {
+            'depth': self.depth,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'failures': self.failures,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+        }
+
+    def _write_each(self, batch):
+        """
+        Write the votes of a failed batch one at a time and return how
+        many were written. The voters were told their vote was received,
+        so a vote that fails is kept for the next flush, with the votes
+        after it, unless it can never be written.
+        """
+        written = 0
+        for n, vote in enumerate(batch):
+            try:
+                self._write([vote])
+            except IntegrityError:
+                # its question or choice was deleted since it was queued
+                logger.exception("Dropped queued vote %r.", vote)
+                continue
+            except Exception:
+                self._retry.extendleft(reversed(batch[n:]))
+                break
+            self.flushed += 1
+            written += 1
+        return written
+
+    def _take(self, limit):
+        """Remove up to `limit` votes from the queue without blocking."""
+        batch = []
+        while self._retry and len(batch) < limit:
+            batch.append(self._retry.popleft())
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Upsert a batch of votes and recount the affected tallies."""
+        # the last vote of a user in a question wins
+        latest = {(user_id, question_id): choice_id
+                  for user_id, question_id, choice_id in batch}
+        user_ids = {user_id for user_id, _ in latest}
+        question_ids = {question_id for _, question_id in latest}
+        with transaction.atomic():
+            affected = set(latest.values())
+            affected.update(Vote.objects.filter(
+                user_id__in=user_ids, question_id__in=question_ids,
+            ).values_list('choice_id', flat=True))
+            Vote.objects.bulk_create(
+                [Vote(user_id=user_id, question_id=question_id,
+                      choice_id=choice_id)
+                 for (user_id, question_id), choice_id in latest.items()],
+                update_conflicts=True,
+                unique_fields=['user', 'question'],
+                update_fields=['choice', 'updated_at'],
+            )
+            Choice.objects.filter(pk__in=affected).recount_votes()
+            Question.objects.filter(pk__in=question_ids).touch()
+            for question_id in question_ids:
+                expire_results(question_id)
+
+    def _run(self):
+        """Flush the queue every interval until stopped."""
+        try:
+            while not self._stopping.wait(self.flush_interval):
+                self.flush()
+        finally:
+            connection.close()
+
+
+_vote_queue = None
+_vote_queue_lock = threading.Lock()
+
+
+def get_vote_queue():
+    """Return the process-wide vote queue, creating it on first use."""
+    global _vote_queue
+    with _vote_queue_lock:
+        if _vote_queue is None:
+            _vote_queue = VoteQueue.from_settings()
+        return _vote_queue
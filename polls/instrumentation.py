@@ -0,0 +1,71 @@
+"""Per-view aggregates of SQL, template and wall time."""
+import heapq
+import threading
+import time
+
+
+class RequestMetrics:
+    """Thread-safe running totals of request timings keyed by URL name."""
+
+    FIELDS = ('requests', 'queries', 'sql_ms', 'template_ms', 'wall_ms',
+              'max_wall_ms', 'over_budget')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, name, queries, sql_ms, template_ms, wall_ms,
+               over_budget):
+        """Add the timings of one request to the totals of `name`."""
+        with self._lock:
+            totals = self._views.setdefault(name, dict.fromkeys(self.FIELDS, 0))
+            totals['requests'] += 1
+            totals['queries'] += queries
+            totals['sql_ms'] += sql_ms
+            totals['template_ms'] += template_ms
+            totals['wall_ms'] += wall_ms
+            totals['max_wall_ms'] = max(totals['max_wall_ms'], wall_ms)
+            totals['over_budget'] += over_budget
+
+    def snapshot(self):
+        """Return the totals and per-request averages of every view."""
+        with self._lock:
+            views = {name: dict(totals) for name, totals in self._views.items()}
+        for totals in views.values():
+            count = totals['requests']
+            for field in ('queries', 'sql_ms', 'template_ms', 'wall_ms'):
+                totals[f'avg_{field}'] = round(totals[field] / count, 3)
+            for field in ('sql_ms', 'template_ms', 'wall_ms', 'max_wall_ms'):
+                totals[field] = round(totals[field], 3)
+        return views
+
+    def reset(self):
+        """Forget all recorded requests."""
+        with self._lock:
+            self._views.clear()
+
+
+request_metrics = RequestMetrics()
+
+
+class QueryTimer:
+    """Database execute wrapper that counts and times queries."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(((time.perf_counter() - started) * 1000, sql))
+
+    @property
+    def total_ms(self):
+        """Return the time spent in SQL, in milliseconds."""
+        return sum(duration for duration, _ in self.queries)
+
+    def slowest(self, count=3):
+        """Return the `count` slowest (milliseconds, sql) pairs."""
+        return heapq.nlargest(count, self.queries, key=lambda query: query[0])
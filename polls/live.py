@@ -0,0 +1,226 @@
+"""
+Live poll results pushed to browsers over Server-Sent Events.
+
+Vote writes publish the id of the question they changed to an in-process
+broker. For every watched question the broker runs one task on the event
+loop that reloads the (cached) results at most POLLS_STREAM_MAX_RATE times
+per second and wakes its subscribers, so a burst of votes costs a few
+reloads however many browsers watch the poll. A subscriber only keeps the
+latest results, never a backlog: a slow client skips the states it could
+not send in time. Idle watchers are coroutines waiting on an event, not
+threads, so one ASGI worker can hold thousands of them.
+"""
+import asyncio
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .results import cached_results_by_id
+
+# how long a browser waits before reconnecting to an ended stream
+RECONNECT_MS = 1000
+
+
+class _Topic:
+    """The watchers of one question on one event loop."""
+
+    def __init__(self, question_id, loop):
+        self.question_id = question_id
+        self.loop = loop
+        self.changed = asyncio.Event()
+        self.subscribers = set()
+        self.results = None
+        self.version = 0
+        self.pump = None
+
+
+class Subscription:
+    """One client watching the results of a question."""
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.wakeup = asyncio.Event()
+        self.version = topic.version
+
+    async def next_results(self, timeout=None):
+        """
+        Wait for results newer than the last ones returned and return
+        them, None if the question is gone. Raise asyncio.TimeoutError if
+        `timeout` seconds pass without news.
+        """
+        if self.version == self.topic.version:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        self.wakeup.clear()
+        self.version = self.topic.version
+        return self.topic.results
+
+
+class ResultsBroker:
+    """In-process publish/subscribe of changed poll results."""
+
+    def __init__(self, max_rate=2.0):
+        self.max_rate = max_rate
+        self._topics = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.reloads = 0
+
+    @classmethod
+    def from_settings(cls):
+        """Create a broker configured by the POLLS_STREAM_* settings."""
+        return cls(max_rate=settings.POLLS_STREAM_MAX_RATE)
+
+    def subscribe(self, question_id):
+        """Start watching a question from the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            topics = self._topics.setdefault(question_id, {})
+            topic = topics.get(loop)
+            if topic is None:
+                topic = topics[loop] = _Topic(question_id, loop)
+                topic.pump = loop.create_task(self._pump(topic))
+            subscription = Subscription(topic)
+            topic.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop watching, the last watcher of a question stops its task."""
+        topic = subscription.topic
+        with self._lock:
+            topic.subscribers.discard(subscription)
+            if topic.subscribers:
+                return
+            topics = self._topics.get(topic.question_id, {})
+            if topics.get(topic.loop) is topic:
+                del topics[topic.loop]
+            if not topics:
+                self._topics.pop(topic.question_id, None)
+        topic.pump.cancel()
+
+    def publish(self, question_id):
+        """
+        Tell the watchers of a question that its results changed. Safe to
+        call from any thread and cheap when nobody watches the question.
+        """
+        with self._lock:
+            topics = list(self._topics.get(question_id, {}).values())
+        for topic in topics:
+            try:
+                topic.loop.call_soon_threadsafe(topic.changed.set)
+            except RuntimeError:
+                # the event loop of these watchers has been closed
+                pass
+        self.published += 1
+
+    async def _pump(self, topic):
+        """Reload the results of a watched question when they change."""
+        while True:
+            await topic.changed.wait()
+            topic.changed.clear()
+            topic.results = await sync_to_async(cached_results_by_id)(
+                topic.question_id)
+            topic.version += 1
+            self.reloads += 1
+            for subscription in list(topic.subscribers):
+                subscription.wakeup.set()
+            # changes arriving meanwhile are coalesced into the next reload
+            await asyncio.sleep(1 / self.max_rate)
+
+    def metrics(self):
+        """Return the number of watched questions and of watchers."""
+        with self._lock:
+            topics = [topic for loops in self._topics.values()
+                      for topic in loops.values()]
+            return {
+                'questions': len(self._topics),
+                'subscribers': sum(len(topic.subscribers)
+                                   for topic in topics),
+                'published': self.published,
+                'reloads': self.reloads,
+            }
+
+
+def sse_event(event, data):
+    """Return one Server-Sent Event carrying `data` as JSON."""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def vote_deltas(previous, results):
+    """
+    Return the choices whose votes or share of the votes changed between
+    two results of a question, with their new count and the change.
+    """
+    before = {choice['id']: choice for choice in previous['choices']}
+    deltas = []
+    for choice in results['choices']:
+        old = before[choice['id']]
+        if (choice['votes'], choice['percentage']) != (old['votes'],
+                                                       old['percentage']):
+            deltas.append({
+                'id': choice['id'],
+                'votes': choice['votes'],
+                'delta': choice['votes'] - old['votes'],
+                'percentage': choice['percentage'],
+            })
+    return deltas
+
+
+async def results_events(broker, question_id, keepalive=15.0,
+                         max_age=300.0):
+    """
+    Yield the Server-Sent Events of a results stream: a snapshot of the
+    results, then the vote deltas of every change, with a comment every
+    `keepalive` idle seconds so proxies keep the connection open.
+
+    The stream ends after `max_age` seconds and the browser reconnects, so
+    the watchers of clients that went away are dropped within that time.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_age
+    subscription = broker.subscribe(question_id)
+    try:
+        # read the snapshot after subscribing so no change falls in between
+        results = await sync_to_async(cached_results_by_id)(question_id)
+        if results is None:
+            yield sse_event('closed', {'id': question_id})
+            return
+        yield f'retry: {RECONNECT_MS}\n' + sse_event('results', results)
+        while loop.time() < deadline:
+            try:
+                latest = await subscription.next_results(
+                    min(keepalive, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if latest is None:
+                yield sse_event('closed', {'id': question_id})
+                return
+            if ({choice['id'] for choice in latest['choices']}
+                    != {choice['id'] for choice in results['choices']}):
+                # choices were added or removed, resend everything
+                yield sse_event('results', latest)
+            else:
+                deltas = vote_deltas(results, latest)
+                if deltas:
+                    yield sse_event('votes', {
+                        'choices': deltas,
+                        'total_votes': latest['total_votes'],
+                    })
+            results = latest
+    finally:
+        broker.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_results_broker():
+    """Return the process-wide results broker, creating it on first use."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = ResultsBroker.from_settings()
+        return _broker
@@ -0,0 +1,127 @@
+"""
+HTTP load test of a running polls server.
+
+Many concurrent keep-alive connections, each an asyncio task, request the
+sync and async versions of the index and results pages of a server, so
+the same views can be compared under a WSGI and an ASGI server at a
+concurrency a thread per client could not reach.
+"""
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from .benchmark import percentile
+
+
+def endpoints(question_id):
+    """Return the paths compared by default, keyed by URL name."""
+    return {
+        'polls:index': '/polls/',
+        'polls:async_index': '/polls/async/',
+        'polls:results': f'/polls/{question_id}/results/',
+        'polls:async_results': f'/polls/async/{question_id}/results/',
+    }
+
+
+class Connection:
+    """A keep-alive HTTP/1.1 connection sending GET requests."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        """Request `path` and return the status code of the response."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+        self.writer.write(f'GET {path} HTTP/1.1\r\n'
+                          f'Host: {self.host}:{self.port}\r\n'
+                          f'Connection: keep-alive\r\n\r\n'.encode())
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("The server closed the connection.")
+        status = int(status_line.split()[1])
+        headers = {}
+        while (line := await self.reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            while size := int((await self.reader.readline()).split(b';')[0],
+                              16):
+                await self.reader.readexactly(size + 2)
+            await self.reader.readline()
+        else:
+            await self.reader.read()
+            headers['connection'] = 'close'
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status
+
+    async def close(self):
+        """Close the connection, the next request opens a new one."""
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.reader = self.writer = None
+
+
+async def load(url, path, concurrency, requests):
+    """
+    Send `requests` GET requests for `path` to the server at `url` over
+    `concurrency` connections and return their statistics.
+    """
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    remaining = iter(range(requests))
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        connection = Connection(host, port)
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                status = await connection.get(path)
+            except (OSError, ValueError, IndexError,
+                    asyncio.IncompleteReadError):
+                errors += 1
+                await connection.close()
+                continue
+            if status >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+        await connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0,
+    }
+
+
+def run_loadtest(url, paths, concurrency=100, requests=1000):
+    """
+    Load the server at `url` with each of `paths`, a dict of paths keyed
+    by name, one after the other and return their statistics by name.
+    """
+    async def run():
+        return {name: await load(url, path, concurrency, requests)
+                for name, path in paths.items()}
+    return asyncio.run(run())
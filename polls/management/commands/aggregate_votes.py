@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from polls.rollups import aggregate_votes, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ("Count the votes changed since the last run into the per-minute "
+            "and per-hour rollups of the trend charts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Drop the rollups and count every vote "
+                                 "again first.")
+        parser.add_argument('--lag', type=float, metavar='SECONDS',
+                            help="Leave the votes of the last SECONDS seconds "
+                                 "to the next run (default "
+                                 "POLLS_ROLLUP_LAG).")
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help="Keep running in the background, "
+                                 "aggregating every SECONDS seconds.")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.report(rebuild_rollups(lag=options['lag']))
+        while True:
+            self.report(aggregate_votes(lag=options['lag']))
+            if not options['every']:
+                return
+            # do not hold a connection open between rounds
+            connection.close()
+            time.sleep(options['every'])
+
+    def report(self, aggregated):
+        self.stdout.write(self.style.SUCCESS(
+            f"Aggregated {aggregated['votes']} vote(s) into "
+            f"{aggregated['buckets']} minute bucket(s) up to "
+            f"{aggregated['watermark']:%Y-%m-%d %H:%M:%S}."))
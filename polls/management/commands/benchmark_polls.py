@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from polls.benchmark import run_benchmark, seed
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the polls views on synthetic data in a throwaway "
+            "test database and report query counts and latency as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=100)
+        parser.add_argument('--choices', type=int, default=4,
+                            help="Choices per question.")
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--votes', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=100,
+                            help="Requests per endpoint.")
+        parser.add_argument('--endpoints', nargs='+',
+                            help="Only benchmark these URL names, "
+                                 "e.g. polls:index signup.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the JSON report here.")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            seed(questions=options['questions'], choices=options['choices'],
+                 users=options['users'], votes=options['votes'],
+                 seed=options['seed'])
+            endpoints = run_benchmark(requests=options['requests'],
+                                      seed=options['seed'],
+                                      only=options['endpoints'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = json.dumps({
+            'scale': {key: options[key] for key in
+                      ('questions', 'choices', 'users', 'votes', 'requests')},
+            'endpoints': endpoints,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        else:
+            self.stdout.write(report)
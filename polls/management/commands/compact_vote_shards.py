@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from polls.models import Choice
+
+
+class Command(BaseCommand):
+    help = ("Fold the votes counted in the tally shards of sharded polls "
+            "into the per-choice vote tallies.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('question_ids', nargs='*', type=int,
+                            help="Only compact the choices of these questions.")
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help="Keep running in the background, compacting "
+                                 "every SECONDS seconds.")
+
+    def handle(self, *args, **options):
+        choices = Choice.objects.all()
+        if options['question_ids']:
+            choices = choices.filter(question_id__in=options['question_ids'])
+        while True:
+            compacted = choices.compact_tally_shards()
+            self.stdout.write(self.style.SUCCESS(
+                f"Compacted the vote shards of {compacted} choice(s)."))
+            if not options['every']:
+                return
+            # do not hold a connection open between rounds
+            connection.close()
+            time.sleep(options['every'])
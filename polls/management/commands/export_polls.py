@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from polls.transfer import (FORMATS, export_records, guess_format,
+                            open_poll_file, write_records)
+
+
+class Command(BaseCommand):
+    help = ("Export the questions, choices and votes as JSON Lines or CSV, "
+            "streaming them from the database in chunks.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('question_ids', nargs='*', type=int,
+                            help="Only export these questions.")
+        parser.add_argument('--output', default='-',
+                            help="File to write, .gz to compress it. "
+                                 "Standard output by default.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help="Guessed from the file name by default.")
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="Rows read from the database at a time.")
+
+    def handle(self, *args, **options):
+        output = options['output']
+        format = options['format'] or guess_format(output)
+        records = export_records(options['question_ids'],
+                                 chunk_size=options['chunk_size'])
+        if output == '-':
+            count = write_records(records, self.stdout, format)
+        else:
+            with open_poll_file(output, 'w') as stream:
+                count = write_records(records, stream, format)
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} record(s)."))
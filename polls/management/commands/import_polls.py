@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.transfer import (FORMATS, guess_format, import_records,
+                            open_poll_file, read_records)
+
+
+class Command(BaseCommand):
+    help = ("Import questions, choices and votes from JSON Lines or CSV, "
+            "streaming the file and inserting it in batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="File to read, .gz if compressed, "
+                                          "or - for standard input.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help="Guessed from the file name by default.")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Rows inserted at a time.")
+        parser.add_argument('--create-users', action='store_true',
+                            help="Create the voters missing from the "
+                                 "database, without a usable password.")
+
+    def handle(self, *args, **options):
+        path = options['input']
+        format = options['format'] or guess_format(path)
+        stream = sys.stdin if path == '-' else open_poll_file(path, 'r')
+        try:
+            counts = import_records(read_records(stream, format),
+                                    batch_size=options['batch_size'],
+                                    create_users=options['create_users'])
+        except KeyError as error:
+            raise CommandError(f"Cannot import {path}: missing field {error}.")
+        except ValueError as error:
+            # PollFileError, or a line that is not valid JSON
+            raise CommandError(f"Cannot import {path}: {error}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(self.style.SUCCESS(
+            "Imported {question} question(s), {choice} choice(s), "
+            "{vote} vote(s) and created {user} user(s).".format(**counts)))
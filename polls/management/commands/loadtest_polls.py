@@ -0,0 +1,63 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.loadtest import endpoints, run_loadtest
+from polls.models import Question
+
+
+class Command(BaseCommand):
+    help = ("Load test the sync and async polls views of a running server "
+            "and report requests per second and latency percentiles.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help="Base URL of the running server.")
+        parser.add_argument('--label', default='server',
+                            help="Name of this run in the report, "
+                                 "e.g. wsgi or asgi.")
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help="Concurrent connections.")
+        parser.add_argument('--requests', type=int, default=1000,
+                            help="Requests per endpoint.")
+        parser.add_argument('--question', type=int,
+                            help="Question of the results pages, the "
+                                 "latest published one by default.")
+        parser.add_argument('--endpoints', nargs='+',
+                            help="Only load these URL names, "
+                                 "e.g. polls:index polls:async_index.")
+        parser.add_argument('--output',
+                            help="Add this run to the JSON report here and "
+                                 "print all the runs it holds.")
+
+    def handle(self, *args, **options):
+        question_id = options['question'] or Question.objects.filter(
+            pub_date__isnull=False).order_by('-pub_date').values_list(
+            'pk', flat=True).first()
+        if question_id is None:
+            raise CommandError("No question to load, pass --question.")
+        paths = {name: path for name, path in endpoints(question_id).items()
+                 if not options['endpoints'] or name in options['endpoints']}
+        result = run_loadtest(options['url'], paths,
+                              concurrency=options['concurrency'],
+                              requests=options['requests'])
+
+        report = {}
+        if options['output'] and os.path.exists(options['output']):
+            with open(options['output']) as existing:
+                report = json.load(existing)
+        report[options['label']] = result
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+                output.write('\n')
+
+        self.stdout.write(f"{'run':<10} {'endpoint':<22} {'rps':>9} "
+                          f"{'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for label, runs in report.items():
+            for name, stats in runs.items():
+                self.stdout.write(
+                    f"{label:<10} {name:<22} {stats['throughput_rps']:>9} "
+                    f"{stats['p50_ms']:>9} {stats['p99_ms']:>9} "
+                    f"{stats['errors']:>7}")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from polls.models import Choice, Question
+from polls.signals import expire_results
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-choice vote tallies from the Vote table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('question_ids', nargs='*', type=int,
+                            help="Only rebuild the choices of these questions.")
+
+    def handle(self, *args, **options):
+        choices = Choice.objects.all()
+        questions = Question.objects.all()
+        if options['question_ids']:
+            choices = choices.filter(question_id__in=options['question_ids'])
+            questions = questions.filter(pk__in=options['question_ids'])
+        with transaction.atomic():
+            updated = choices.recount_votes()
+            # the results pages and their validators show the new totals
+            questions.touch()
+            for question_id in questions.values_list('pk', flat=True):
+                expire_results(question_id)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt vote counts for {updated} choice(s)."))
@@ -0,0 +1,150 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.db import connections
+
+from .instrumentation import QueryTimer, request_metrics
+from .routers import use_primary
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class ReplicaPinningMiddleware:
+    """
+    Give read-your-writes consistency on top of the replica router.
+
+    A request that may write (any unsafe method) reads from the primary
+    and marks the client with a short-lived cookie, so its following
+    requests also read from the primary until the replicas caught up.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._pinned(request):
+            return self.get_response(request)
+        with use_primary():
+            response = self.get_response(request)
+        return self._pin(request, response)
+
+    async def __acall__(self, request):
+        """Async version of __call__, the router sees the same context."""
+        if not self._pinned(request):
+            return await self.get_response(request)
+        with use_primary():
+            response = await self.get_response(request)
+        return self._pin(request, response)
+
+    def _pinned(self, request):
+        """Return True if the request must read from the primary."""
+        return (request.method not in SAFE_METHODS
+                or settings.POLLS_REPLICA_PIN_COOKIE in request.COOKIES)
+
+    def _pin(self, request, response):
+        """Mark the client of a request that may write."""
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(settings.POLLS_REPLICA_PIN_COOKIE, '1',
+                                httponly=True, samesite='Lax',
+                                max_age=settings.POLLS_REPLICA_PIN_SECONDS)
+        return response
+
+
+class InstrumentationMiddleware:
+    """
+    Measure the query count, SQL time, template render time and wall time
+    of every request, report them in a Server-Timing header, add them to
+    the per-view totals and log requests over POLLS_REQUEST_BUDGET_MS
+    together with their slowest queries.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        request._polls_template_ms = 0.0
+        started = time.perf_counter()
+        with self._timed_queries(timer):
+            response = self.get_response(request)
+        return self._record(request, response, timer, started)
+
+    async def __acall__(self, request):
+        """
+        Async version of __call__. The queries of an async request run in
+        its sync thread, so the timer is installed on the connections of
+        that thread.
+        """
+        timer = QueryTimer()
+        request._polls_template_ms = 0.0
+        started = time.perf_counter()
+        stack = await sync_to_async(self._timed_queries)(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self._record(request, response, timer, started)
+
+    def _timed_queries(self, timer):
+        """Return a context that times the queries on every connection."""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        return stack
+
+    def _record(self, request, response, timer, started):
+        """Report the timings of a request and log it if too slow."""
+        wall_ms = (time.perf_counter() - started) * 1000
+        sql_ms = timer.total_ms
+        template_ms = request._polls_template_ms
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={sql_ms:.2f};desc="{len(timer.queries)} queries"',
+            f'tpl;dur={template_ms:.2f}',
+            f'total;dur={wall_ms:.2f}',
+        ])
+        match = request.resolver_match
+        name = match.view_name if match else 'unresolved'
+        over_budget = wall_ms > settings.POLLS_REQUEST_BUDGET_MS
+        request_metrics.record(name, len(timer.queries), sql_ms, template_ms,
+                               wall_ms, over_budget)
+        if over_budget:
+            logger.warning(
+                "%s %s (%s) took %.1f ms with %d queries in %.1f ms. "
+                "Slowest queries:\n%s",
+                request.method, request.path, name, wall_ms,
+                len(timer.queries), sql_ms,
+                '\n'.join(f'  {duration:.1f} ms: {sql}'
+                          for duration, sql in timer.slowest()),
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        """Time the rendering of a template response."""
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._polls_template_ms += (time.perf_counter() - started) * 1000
+
+        response.add_post_render_callback(rendered)
+        return response
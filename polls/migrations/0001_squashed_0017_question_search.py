@@ -0,0 +1,87 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# The search index is built by raw SQL for each database vendor, shared
+# with 0017 until the replaced migrations are deleted and it moves here.
+# The vote tally and vote question backfills of 0012 and 0014 are elided,
+# a new database has no votes to count.
+search = import_module('polls.migrations.0017_question_search')
+
+
+class Migration(migrations.Migration):
+
+    replaces = [
+        ('polls', '0001_initial'),
+        ('polls', '0002_question_end_date'),
+        ('polls', '0003_remove_question_end_date'),
+        ('polls', '0004_question_end_date'),
+        ('polls', '0005_alter_question_pub_date'),
+        ('polls', '0006_alter_question_pub_date'),
+        ('polls', '0007_remove_question_end_date'),
+        ('polls', '0008_question_end_date'),
+        ('polls', '0009_alter_question_end_date_alter_question_pub_date'),
+        ('polls', '0010_alter_question_end_date_alter_question_pub_date'),
+        ('polls', '0011_remove_choice_votes_alter_question_end_date_vote'),
+        ('polls', '0012_choice_vote_count'),
+        ('polls', '0013_question_indexes'),
+        ('polls', '0014_vote_question'),
+        ('polls', '0015_vote_unique_user_question'),
+        ('polls', '0016_question_updated_at'),
+        ('polls', '0017_question_search'),
+    ]
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Question',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_text', models.CharField(max_length=200)),
+                ('pub_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date published')),
+                ('end_date', models.DateTimeField(blank=True, default=None, null=True, verbose_name='date suppressed')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='last changed')),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['-pub_date', '-id'], name='polls_question_latest_idx'),
+                    models.Index(fields=['pub_date', 'end_date'], name='polls_question_window_idx'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='Choice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('choice_text', models.CharField(max_length=200)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+                ('vote_count', models.PositiveIntegerField(default=0, editable=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(fields=('user', 'question'), name='polls_vote_one_per_user_question'),
+                ],
+            },
+        ),
+        migrations.RunPython(
+            search.run({'sqlite': search.SQLITE_FORWARD}),
+            search.run({'sqlite': search.SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_vote_question(apps, schema_editor):
+    """
+    Copy the question of each vote from its choice and drop duplicate
+    votes of a user in the same question, keeping the latest one.
+    """
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    Vote.objects.update(question_id=Subquery(
+        Choice.objects.filter(pk=OuterRef('choice_id')).values('question_id')
+    ))
+    duplicates = (Vote.objects.values('user_id', 'question_id')
+                  .annotate(votes=Count('pk'), latest=Max('pk'))
+                  .filter(votes__gt=1))
+    for duplicate in duplicates.iterator():
+        Vote.objects.filter(
+            user_id=duplicate['user_id'],
+            question_id=duplicate['question_id'],
+        ).exclude(pk=duplicate['latest']).delete()
+    counted = Vote.objects.filter(
+        choice=OuterRef('pk')
+    ).order_by().values('choice').annotate(total=Count('pk')).values('total')
+    Choice.objects.update(vote_count=Coalesce(Subquery(counted), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0013_question_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.RunPython(backfill_vote_question, migrations.RunPython.noop,
+                             elidable=True),
+    ]
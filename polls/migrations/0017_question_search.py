@@ -0,0 +1,114 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# Full-text index of each question with the text of its choices, kept in
+# sync by triggers so bulk inserts and raw updates are indexed as well.
+# Triggers only watch the text columns, votes never touch the index.
+# Other databases have no index and search with LIKE.
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE polls_question_search USING fts5(
+        question_text, choices, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER polls_question_search_insert
+    AFTER INSERT ON polls_question BEGIN
+        INSERT INTO polls_question_search (rowid, question_text, choices)
+        VALUES (new.id, new.question_text, '');
+    END
+    """,
+    """
+    CREATE TRIGGER polls_question_search_update
+    AFTER UPDATE OF question_text ON polls_question BEGIN
+        UPDATE polls_question_search SET question_text = new.question_text
+        WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER polls_question_search_delete
+    AFTER DELETE ON polls_question BEGIN
+        DELETE FROM polls_question_search WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER polls_choice_search_insert
+    AFTER INSERT ON polls_choice BEGIN
+        UPDATE polls_question_search SET choices = (
+            SELECT group_concat(choice_text, ' ') FROM polls_choice
+            WHERE question_id = new.question_id
+        ) WHERE rowid = new.question_id;
+    END
+    """,
+    """
+    CREATE TRIGGER polls_choice_search_update
+    AFTER UPDATE OF choice_text, question_id ON polls_choice BEGIN
+        UPDATE polls_question_search SET choices = coalesce((
+            SELECT group_concat(choice_text, ' ') FROM polls_choice
+            WHERE question_id = old.question_id
+        ), '') WHERE rowid = old.question_id;
+        UPDATE polls_question_search SET choices = (
+            SELECT group_concat(choice_text, ' ') FROM polls_choice
+            WHERE question_id = new.question_id
+        ) WHERE rowid = new.question_id;
+    END
+    """,
+    """
+    CREATE TRIGGER polls_choice_search_delete
+    AFTER DELETE ON polls_choice BEGIN
+        UPDATE polls_question_search SET choices = coalesce((
+            SELECT group_concat(choice_text, ' ') FROM polls_choice
+            WHERE question_id = old.question_id
+        ), '') WHERE rowid = old.question_id;
+    END
+    """,
+    """
+    INSERT INTO polls_question_search (rowid, question_text, choices)
+    SELECT polls_question.id, polls_question.question_text,
+           coalesce(group_concat(polls_choice.choice_text, ' '), '')
+    FROM polls_question
+    LEFT JOIN polls_choice ON polls_choice.question_id = polls_question.id
+    GROUP BY polls_question.id
+    """,
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS polls_choice_search_delete',
+    'DROP TRIGGER IF EXISTS polls_choice_search_update',
+    'DROP TRIGGER IF EXISTS polls_choice_search_insert',
+    'DROP TRIGGER IF EXISTS polls_question_search_delete',
+    'DROP TRIGGER IF EXISTS polls_question_search_update',
+    'DROP TRIGGER IF EXISTS polls_question_search_insert',
+    'DROP TABLE IF EXISTS polls_question_search',
+]
+
+
+def run(statements):
+    """Return a migration function running the statements of its vendor."""
+    def migrate(apps, schema_editor):
+        connection = schema_editor.connection
+        for statement in statements.get(connection.vendor, []):
+            try:
+                schema_editor.execute(statement)
+            except OperationalError:
+                # SQLite built without FTS5, searches use LIKE instead
+                if connection.vendor != 'sqlite' or statement is not (
+                        SQLITE_FORWARD[0]):
+                    raise
+                return
+    return migrate
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0016_question_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARD}),
+            run({'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
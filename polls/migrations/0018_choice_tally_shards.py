@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0001_squashed_0017_question_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='tally_shards',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Count the votes of each choice in this many rows so that concurrent voters do not wait on each other. Leave empty to count each choice in a single row.', null=True, verbose_name='tally shards'),
+        ),
+        migrations.CreateModel(
+            name='ChoiceTallyShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='choicetallyshard',
+            constraint=models.UniqueConstraint(fields=('choice', 'shard'), name='polls_tally_shard_per_choice'),
+        ),
+    ]
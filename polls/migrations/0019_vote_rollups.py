@@ -0,0 +1,64 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0018_choice_tally_shards'),
+    ]
+
+    operations = [
+        # added without a default first, so the votes cast so far keep an
+        # unknown time instead of all seeming cast during the migration
+        migrations.AddField(
+            model_name='vote',
+            name='created_at',
+            field=models.DateTimeField(null=True, verbose_name='voted at'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True, verbose_name='voted at'),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='changed at'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['updated_at'], name='polls_vote_changed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['question', 'created_at'], name='polls_vote_timeline_idx'),
+        ),
+        migrations.CreateModel(
+            name='VoteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('period', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour')], max_length=6)),
+                ('start', models.DateTimeField()),
+                ('votes', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['question', 'period', 'start'], name='polls_rollup_series_idx'),
+                ],
+                'constraints': [
+                    models.UniqueConstraint(fields=('choice', 'period', 'start'), name='polls_rollup_per_bucket'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('position', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
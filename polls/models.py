@@ -1,11 +1,72 @@
 import datetime
 
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, models, transaction
+from django.db.models import (Case, Count, F, OuterRef, Q, Subquery, Sum,
+                              Value, When)
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib import admin
 from django.contrib.auth.models import User
 
 
+def _published_at(now):
+    return Q(pub_date__lte=now)
+
+
+def _open_at(now):
+    return _published_at(now) & (Q(end_date__isnull=True)
+                                 | Q(end_date__gt=now))
+
+
+def _closed_at(now):
+    return _published_at(now) & Q(end_date__lte=now)
+
+
+class QuestionQuerySet(models.QuerySet):
+    """
+    QuerySet helpers of questions. The filters are the SQL versions of
+    the Question methods of the same meaning and served by the
+    (pub_date, end_date) index; each takes the time to compare with,
+    now by default.
+    """
+
+    def touch(self):
+        """Mark the selected questions as changed now."""
+        return self.update(updated_at=timezone.now())
+
+    def published(self, now=None):
+        """Select the questions for which is_published() is True."""
+        return self.filter(_published_at(now or timezone.now()))
+
+    def open_now(self, now=None):
+        """Select the questions for which can_vote() is True."""
+        return self.filter(_open_at(now or timezone.now()))
+
+    def closed(self, now=None):
+        """Select the published questions whose voting period has ended."""
+        return self.filter(_closed_at(now or timezone.now()))
+
+    def recent(self, now=None):
+        """Select the questions for which was_published_recently() is True."""
+        now = now or timezone.now()
+        return self.filter(pub_date__gte=now - datetime.timedelta(days=1),
+                           pub_date__lte=now)
+
+    def with_status(self, now=None):
+        """
+        Annotate the questions with their `status`: 'open', 'closed' or,
+        for those not published yet, 'scheduled'.
+        """
+        now = now or timezone.now()
+        return self.annotate(status=Case(
+            When(_open_at(now), then=Value('open')),
+            When(_closed_at(now), then=Value('closed')),
+            default=Value('scheduled'),
+            output_field=models.CharField(),
+        ))
+
+
 class Question(models.Model):
     """
     A template model representing questions.
@@ -14,6 +75,26 @@ class Question(models.Model):
     pub_date = models.DateTimeField('date published', default=timezone.now)
     end_date = models.DateTimeField('date suppressed', null=True,
                                     default=None, blank=True)
+    # bumped whenever the question or its votes change, for conditional GET
+    updated_at = models.DateTimeField('last changed', auto_now=True)
+    tally_shards = models.PositiveSmallIntegerField(
+        'tally shards', null=True, blank=True,
+        help_text="Count the votes of each choice in this many rows so that "
+                  "concurrent voters do not wait on each other. Leave empty "
+                  "to count each choice in a single row.",
+    )
+
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # newest-first listing with keyset pagination on the index page
+            models.Index(fields=['-pub_date', '-id'],
+                         name='polls_question_latest_idx'),
+            # voting window filter of published(), open_now() and closed()
+            models.Index(fields=['pub_date', 'end_date'],
+                         name='polls_question_window_idx'),
+        ]
 
     def __str__(self):
         """Return the text of the question"""
@@ -41,6 +122,66 @@ class Question(models.Model):
             return self.is_published()
         return self.is_published() and now < self.end_date
 
+    @property
+    def sharded(self):
+        """Return True if the vote tallies are spread over shard rows."""
+        return (self.tally_shards or 1) > 1
+
+    def tally_shard(self, user_id):
+        """Return the shard counting the votes of `user_id`, if sharded."""
+        return user_id % self.tally_shards if self.sharded else None
+
+
+class ChoiceQuerySet(models.QuerySet):
+    """QuerySet helpers for keeping the denormalized vote tally in sync."""
+
+    def add_votes(self, delta):
+        """Atomically add `delta` to the vote tally of the selected choices."""
+        return self.update(vote_count=F('vote_count') + delta)
+
+    def recount_votes(self):
+        """Rebuild the vote tally of the selected choices from the Vote table."""
+        counted = Vote.objects.filter(
+            choice=OuterRef('pk')
+        ).order_by().values('choice').annotate(total=Count('pk')).values('total')
+        with transaction.atomic():
+            ChoiceTallyShard.objects.filter(
+                choice__in=self.values('pk')).delete()
+            return self.update(vote_count=Coalesce(Subquery(counted), 0))
+
+    def with_tally(self):
+        """
+        Annotate the selected choices with their `tally`, the vote_count
+        plus the votes counted in their shards since the last compaction.
+        """
+        sharded = ChoiceTallyShard.objects.filter(
+            choice=OuterRef('pk')
+        ).order_by().values('choice').annotate(total=Sum('votes')).values('total')
+        return self.annotate(
+            tally=F('vote_count') + Coalesce(Subquery(sharded), 0))
+
+    def compact_tally_shards(self):
+        """
+        Fold the votes counted in the shards of the selected choices into
+        their vote_count, one choice per transaction. Return the number
+        of choices compacted.
+        """
+        choice_ids = list(ChoiceTallyShard.objects.filter(
+            choice__in=self.values('pk')
+        ).exclude(votes=0).values_list('choice_id', flat=True).distinct())
+        for choice_id in choice_ids:
+            with transaction.atomic():
+                shards = list(ChoiceTallyShard.objects.filter(
+                    choice_id=choice_id).exclude(votes=0).values_list(
+                    'pk', 'votes'))
+                for pk, votes in shards:
+                    # subtract what was read, votes counted meanwhile stay
+                    ChoiceTallyShard.objects.filter(pk=pk).update(
+                        votes=F('votes') - votes)
+                Choice.objects.filter(pk=choice_id).add_votes(
+                    sum(votes for _, votes in shards))
+        return len(choice_ids)
+
 
 class Choice(models.Model):
     """
@@ -48,20 +189,204 @@ class Choice(models.Model):
     """
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
-    votes = models.IntegerField(default=0)
+    vote_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ChoiceQuerySet.as_manager()
 
     @property
     def votes(self):
-        """count the votes for this choice."""
-        # choice = Vote.objects.filter(choice=self).count()
-        return self.vote_set.count()
+        """
+        Return the number of votes for this choice. Choices loaded with
+        with_tally() have it already, otherwise the votes counted in the
+        tally shards take an aggregate query on every access.
+        """
+        if hasattr(self, 'tally'):
+            return self.tally
+        sharded = self.choicetallyshard_set.aggregate(total=Sum('votes'))
+        return self.vote_count + (sharded['total'] or 0)
 
     def __str__(self):
         """Return text of the choice"""
         return self.choice_text
 
 
+class ChoiceTallyShardManager(models.Manager):
+    """Manager that counts votes in the shards of a choice tally."""
+
+    def add_votes(self, choice_id, shard, delta):
+        """Atomically add `delta` to one shard of the tally of a choice."""
+        shards = self.filter(choice_id=choice_id, shard=shard)
+        if shards.update(votes=F('votes') + delta):
+            return
+        try:
+            with transaction.atomic():
+                self.create(choice_id=choice_id, shard=shard, votes=delta)
+        except IntegrityError:
+            # a concurrent vote created the shard first
+            shards.update(votes=F('votes') + delta)
+
+    def discount_vote(self, choice_id):
+        """Take one vote off a shard of a choice that still counts some."""
+        counting = self.filter(choice_id=choice_id, votes__gt=0)
+        return self.filter(pk=Subquery(counting.values('pk')[:1])).update(
+            votes=F('votes') - 1)
+
+
+class ChoiceTallyShard(models.Model):
+    """
+    Part of the vote tally of a choice of a sharded question, whose votes
+    are spread over several rows instead of all locking Choice.vote_count.
+    """
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    # below zero when voters counted elsewhere switch away from the choice
+    votes = models.IntegerField(default=0)
+
+    objects = ChoiceTallyShardManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'shard'],
+                                    name='polls_tally_shard_per_choice'),
+        ]
+
+
+class VoteQuerySet(models.QuerySet):
+    """QuerySet helpers keeping the tallies right when votes are deleted."""
+
+    def delete(self):
+        """
+        Delete the selected votes, then recount the tallies and rollups
+        of their choices once, however many votes there are.
+        """
+        # the signals module imports the models
+        from .signals import counted_in, recount_deleted_votes
+        with transaction.atomic(using=self.db):
+            counted = counted_in(self)
+            deleted = super().delete()
+            recount_deleted_votes(*counted)
+        return deleted
+
+
+class VoteManager(models.Manager.from_queryset(VoteQuerySet)):
+    """Manager that records votes and maintains the choice tallies."""
+
+    def cast(self, user, choice):
+        """
+        Record the vote of `user` for `choice`, replacing any previous vote
+        of that user in the same question, and update the vote tallies.
+        """
+        with transaction.atomic():
+            # the unique (user, question) constraint makes this safe
+            # against concurrent votes of the same user
+            vote, created = self.select_for_update().get_or_create(
+                user=user, question_id=choice.question_id,
+                defaults={'choice': choice},
+            )
+            question = choice.question
+            if created:
+                self._count(question, choice.pk, user.pk, 1)
+            elif vote.choice_id != choice.pk:
+                self._count(question, vote.choice_id, user.pk, -1)
+                self._count(question, choice.pk, user.pk, 1)
+                vote.choice = choice
+                vote.save(update_fields=['choice', 'updated_at'])
+            else:
+                return vote
+            # the question row of a sharded poll would be as hot as a
+            # single tally row, its results validators use the totals
+            if not question.sharded:
+                Question.objects.filter(pk=choice.question_id).touch()
+        return vote
+
+    @staticmethod
+    def _count(question, choice_id, user_id, delta):
+        """Add `delta` to the tally of a choice, in the voter's shard."""
+        shard = question.tally_shard(user_id)
+        if shard is not None:
+            ChoiceTallyShard.objects.add_votes(choice_id, shard, delta)
+            return
+        choices = Choice.objects.filter(pk=choice_id)
+        if delta < 0:
+            choices = choices.filter(vote_count__gte=-delta)
+        if not choices.add_votes(delta):
+            # counted in a shard before the question stopped being sharded
+            ChoiceTallyShard.objects.discount_vote(choice_id)
+
+    async def acast(self, user, choice):
+        """Async version of cast()."""
+        return await sync_to_async(self.cast)(user, choice)
+
+
 class Vote(models.Model):
     """Records a Vote of a Choice by User."""
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # unknown for the votes cast before votes were timestamped
+    created_at = models.DateTimeField('voted at', null=True,
+                                      default=timezone.now)
+    # bumped when the vote changes, the watermark of the vote rollups
+    updated_at = models.DateTimeField('changed at', auto_now=True)
+
+    objects = VoteManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'question'],
+                                    name='polls_vote_one_per_user_question'),
+        ]
+        indexes = [
+            # votes changed since the rollup watermark
+            models.Index(fields=['updated_at'], name='polls_vote_changed_idx'),
+            # votes of a question cast within a rollup bucket
+            models.Index(fields=['question', 'created_at'],
+                         name='polls_vote_timeline_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Save the vote, taking the question from its choice."""
+        if self.question_id is None:
+            self.question_id = self.choice.question_id
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Delete the vote and take it off the tally of its choice."""
+        from .signals import discount_deleted_vote
+        with transaction.atomic():
+            deleted = super().delete(*args, **kwargs)
+            discount_deleted_vote(self)
+        return deleted
+
+
+class VoteRollup(models.Model):
+    """
+    The number of votes for a choice cast within one minute or one hour,
+    counted by the choice they are for now.
+    """
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    PERIODS = [(MINUTE, 'Minute'), (HOUR, 'Hour')]
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    period = models.CharField(max_length=6, choices=PERIODS)
+    start = models.DateTimeField()
+    votes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'period', 'start'],
+                                    name='polls_rollup_per_bucket'),
+        ]
+        indexes = [
+            # the time series of a question
+            models.Index(fields=['question', 'period', 'start'],
+                         name='polls_rollup_series_idx'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """The Vote.updated_at up to which a rollup has been aggregated."""
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.DateTimeField(null=True)
@@ -0,0 +1,74 @@
+"""Keyset (cursor) pagination over questions ordered by (pub_date, id)."""
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+# the largest id a database integer column holds
+MAX_ID = 2 ** 63 - 1
+
+
+def encode_cursor(question):
+    """Return an opaque cursor pointing just past `question`."""
+    value = f'{question.pub_date.isoformat()}|{question.pk}'
+    return urlsafe_base64_encode(value.encode())
+
+
+def decode_cursor(cursor):
+    """
+    Return the (pub_date, id) pair encoded in `cursor`.
+    Raise ValueError if the cursor is malformed.
+    """
+    try:
+        pub_date, pk = force_str(urlsafe_base64_decode(cursor)).split('|')
+        pub_date, pk = datetime.datetime.fromisoformat(pub_date), int(pk)
+    except (TypeError, UnicodeDecodeError) as error:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from error
+    if pub_date.tzinfo is None or not 0 < pk <= MAX_ID:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return pub_date, pk
+
+
+def _page_query(queryset, cursor, page_size):
+    """
+    Return the query of the published questions after `cursor` plus one.
+    A cursor page has the cursor's pub_date as its only upper bound, which
+    implies publication, so SQLite seeks the index to the cursor instead
+    of scanning every question from now down to it.
+    """
+    queryset = queryset.order_by('-pub_date', '-id')
+    if not cursor:
+        return queryset.published()[:page_size + 1]
+    pub_date, pk = decode_cursor(cursor)
+    if pub_date > timezone.now():
+        raise ValueError(f"Cursor of an unpublished question: {cursor!r}")
+    return queryset.filter(
+        Q(pub_date__lt=pub_date) | Q(id__lt=pk), pub_date__lte=pub_date,
+    )[:page_size + 1]
+
+
+def _split_page(page, page_size):
+    """Return the page and the cursor of the next page, if any."""
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, encode_cursor(page[-1])
+    return page, None
+
+
+def page_before(queryset, cursor, page_size):
+    """
+    Return up to `page_size` published questions of `queryset` that come
+    after `cursor` in (-pub_date, -id) order, and the cursor of the next
+    page or None if this is the last page.
+    """
+    page = list(_page_query(queryset, cursor, page_size))
+    return _split_page(page, page_size)
+
+
+async def apage_before(queryset, cursor, page_size):
+    """Async version of page_before()."""
+    page = [question
+            async for question in _page_query(queryset, cursor, page_size)]
+    return _split_page(page, page_size)
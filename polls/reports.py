@@ -0,0 +1,127 @@
+"""
+Streaming exports of the tallies and raw votes of polls for admins.
+
+Rows are read with iterator(chunk_size=...), which uses a server-side
+cursor where the database supports one, and written to the response as
+they are read, so an export holds one chunk of votes in memory however
+many votes the polls have.
+"""
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Choice, Vote
+
+FORMATS = ('csv', 'json')
+CHUNK_SIZE = 2000
+CSV_HEADER = ['row', 'question_id', 'question_text', 'choice_id',
+              'choice_text', 'votes', 'vote_id', 'user', 'voted_at',
+              'changed_at']
+
+
+def tally_rows(question_ids=None):
+    """Yield (question id, question text, choice id, choice text, votes)."""
+    choices = Choice.objects.with_tally().order_by('question_id', 'pk')
+    if question_ids is not None:
+        choices = choices.filter(question_id__in=question_ids)
+    return choices.values_list(
+        'question_id', 'question__question_text', 'pk', 'choice_text',
+        'tally').iterator(chunk_size=CHUNK_SIZE)
+
+
+def vote_rows(question_ids=None):
+    """
+    Yield (vote id, question id, choice id, choice text, username, voted
+    at, changed at), the times as ISO 8601 or None for older votes.
+    """
+    votes = Vote.objects.order_by('question_id', 'pk')
+    if question_ids is not None:
+        votes = votes.filter(question_id__in=question_ids)
+    for row in votes.values_list(
+            'pk', 'question_id', 'choice_id', 'choice__choice_text',
+            'user__username', 'created_at', 'updated_at').iterator(
+            chunk_size=CHUNK_SIZE):
+        yield row[:5] + tuple(moment.isoformat() if moment else None
+                              for moment in row[5:])
+
+
+class _Line:
+    """A file-like object whose write returns what is written."""
+
+    def write(self, value):
+        return value
+
+
+def csv_export(question_ids=None):
+    """Yield the lines of a CSV with a row per choice then per vote."""
+    writer = csv.writer(_Line())
+    yield writer.writerow(CSV_HEADER)
+    for question_id, question_text, choice_id, choice_text, votes in (
+            tally_rows(question_ids)):
+        yield writer.writerow(['tally', question_id, question_text,
+                               choice_id, choice_text, votes, '', '', '',
+                               ''])
+    for (vote_id, question_id, choice_id, choice_text, username, voted_at,
+         changed_at) in vote_rows(question_ids):
+        yield writer.writerow(['vote', question_id, '', choice_id,
+                               choice_text, '', vote_id, username, voted_at,
+                               changed_at])
+
+
+def json_export(question_ids=None):
+    """Yield the pieces of a JSON document with the tallies and votes."""
+    yield '{"tallies": ['
+    separator = ''
+    for question_id, question_text, choice_id, choice_text, votes in (
+            tally_rows(question_ids)):
+        yield separator + json.dumps({
+            'question_id': question_id, 'question_text': question_text,
+            'choice_id': choice_id, 'choice_text': choice_text,
+            'votes': votes,
+        })
+        separator = ', '
+    yield '], "votes": ['
+    separator = ''
+    for (vote_id, question_id, choice_id, choice_text, username, voted_at,
+         changed_at) in vote_rows(question_ids):
+        yield separator + json.dumps({
+            'id': vote_id, 'question_id': question_id,
+            'choice_id': choice_id, 'choice_text': choice_text,
+            'user': username, 'voted_at': voted_at, 'changed_at': changed_at,
+        })
+        separator = ', '
+    yield ']}\n'
+
+
+def _chunks(pieces, size):
+    """Return the next `size` pieces joined, empty once exhausted."""
+    return ''.join(piece for _, piece in zip(range(size), pieces))
+
+
+async def _aiterate(pieces, size=CHUNK_SIZE):
+    """
+    Serve a sync export under ASGI without reading it all first, pulling
+    `size` pieces at a time from the request's sync thread.
+    """
+    while chunk := await sync_to_async(_chunks)(pieces, size):
+        yield chunk
+
+
+def export_response(request, question_ids=None, format='csv'):
+    """Return a streaming download of the results of some questions."""
+    if format == 'json':
+        pieces, content_type = json_export(question_ids), 'application/json'
+    else:
+        pieces, content_type = csv_export(question_ids), 'text/csv'
+    if isinstance(request, ASGIRequest):
+        # Django would otherwise load a sync iterator into a list
+        pieces = _aiterate(pieces)
+    stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+    return StreamingHttpResponse(pieces, content_type=content_type, headers={
+        'Content-Disposition':
+            f'attachment; filename="poll-results-{stamp}.{format}"',
+    })
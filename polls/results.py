@@ -0,0 +1,105 @@
+"""Aggregated poll results shared by the results page and its JSON API."""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+
+from .models import Choice, Question
+
+
+def _results_of(question, choices):
+    """Return the results of `question` from the values of its choices."""
+    total_votes = sum(choice['tally'] for choice in choices)
+    return {
+        'question': {
+            'id': question.pk,
+            'question_text': question.question_text,
+        },
+        'choices': [
+            {
+                'id': choice['id'],
+                'choice_text': choice['choice_text'],
+                'votes': choice['tally'],
+                'percentage': (round(100 * choice['tally']
+                                     / total_votes, 1)
+                               if total_votes else 0.0),
+            }
+            for choice in choices
+        ],
+        'total_votes': total_votes,
+    }
+
+
+def _choice_values(question, using=None):
+    """Return the query of the values the results need from the choices."""
+    choices = question.choice_set.db_manager(using)
+    return choices.with_tally().order_by('pk').values(
+        'id', 'choice_text', 'tally')
+
+
+def question_results(question, using=None):
+    """
+    Return the vote totals of every choice of `question` together with
+    their share of the turnout, using a single query for all choices.
+    """
+    return _results_of(question, list(_choice_values(question, using)))
+
+
+async def aquestion_results(question, using=None):
+    """Async version of question_results()."""
+    choices = [choice async for choice in _choice_values(question, using)]
+    return _results_of(question, choices)
+
+
+def results_cache_key(question_id):
+    """Return the cache key of the results of a question."""
+    return f'polls:results:{question_id}'
+
+
+def get_cached_results(question_id):
+    """Return the cached results of a question or None if not cached."""
+    return cache.get(results_cache_key(question_id))
+
+
+def cached_question_results(question):
+    """
+    Return the results of `question`, computing them on a cache miss.
+
+    Misses are computed on the database votes are written to, as a
+    lagging replica would otherwise refill the shared cache with totals
+    that voters who read their own writes must not see.
+    """
+    results = get_cached_results(question.pk)
+    if results is None:
+        results = question_results(question, router.db_for_write(Choice))
+        cache.set(results_cache_key(question.pk), results,
+                  settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    return results
+
+
+async def acached_question_results(question):
+    """Async version of cached_question_results()."""
+    key = results_cache_key(question.pk)
+    results = await cache.aget(key)
+    if results is None:
+        results = await aquestion_results(question,
+                                          router.db_for_write(Choice))
+        await cache.aset(key, results, settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    return results
+
+
+def cached_results_by_id(question_id):
+    """
+    Return the results of the question with id `question_id`, or None if
+    there is no such question, reading the question only on a cache miss.
+    """
+    results = get_cached_results(question_id)
+    if results is None:
+        question = Question.objects.filter(pk=question_id).first()
+        if question is not None:
+            results = cached_question_results(question)
+    return results
+
+
+def invalidate_results(question_id):
+    """Drop the cached results of a question."""
+    cache.delete(results_cache_key(question_id))
@@ -0,0 +1,197 @@
+"""
+Per-minute and per-hour vote counts of each choice, for trend charts.
+
+A vote is counted in the buckets of the minute and the hour it was cast,
+under the choice it is for now, so the buckets of a choice add up to its
+tally, apart from votes cast before votes were timestamped. The rollups
+are aggregated incrementally: each run recounts only the buckets of the
+votes changed since the watermark of the previous run, using the index on
+Vote.updated_at, and charts read the rollups instead of the votes.
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncHour, TruncMinute
+from django.utils import timezone
+
+from .models import RollupWatermark, Vote, VoteRollup
+
+WATERMARK = 'votes'
+PERIODS = {
+    VoteRollup.MINUTE: datetime.timedelta(minutes=1),
+    VoteRollup.HOUR: datetime.timedelta(hours=1),
+}
+# points of a trend chart, an hour of minutes or two days of hours
+TREND_POINTS = {VoteRollup.MINUTE: 60, VoteRollup.HOUR: 48}
+# buckets recounted per query, each can add a term to its WHERE clause and
+# SQLite refuses expressions nested more than 1000 deep
+BATCH_SIZE = 200
+
+
+def bucket_start(moment, period):
+    """Return the start of the bucket of `period` containing `moment`."""
+    moment = moment.astimezone(datetime.timezone.utc)
+    if period == VoteRollup.HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(second=0, microsecond=0)
+
+
+def _ranges(starts, length, field='created_at'):
+    """Return a filter of the `field` times in runs of consecutive buckets."""
+    condition = Q()
+    run_start = run_end = None
+    for start in sorted(starts):
+        if run_end is not None and start == run_end:
+            run_end = start + length
+            continue
+        if run_start is not None:
+            condition |= Q(**{f'{field}__gte': run_start,
+                              f'{field}__lt': run_end})
+        run_start, run_end = start, start + length
+    if run_start is not None:
+        condition |= Q(**{f'{field}__gte': run_start, f'{field}__lt': run_end})
+    return condition
+
+
+def _batches(starts):
+    """Yield the sorted `starts` in lists of at most BATCH_SIZE."""
+    starts = sorted(starts)
+    for index in range(0, len(starts), BATCH_SIZE):
+        yield starts[index:index + BATCH_SIZE]
+
+
+def _replace(question_id, period, starts, counts):
+    """Replace the buckets of a question starting at `starts`."""
+    VoteRollup.objects.filter(question_id=question_id, period=period,
+                              start__in=starts).delete()
+    VoteRollup.objects.bulk_create([
+        VoteRollup(question_id=question_id, choice_id=choice_id,
+                   period=period, start=start, votes=votes)
+        for (choice_id, start), votes in counts.items() if votes
+    ])
+
+
+def recount_buckets(minutes):
+    """
+    Recount the minute buckets of the (question id, minute) pairs in
+    `minutes` from the votes, then the hours containing them from the
+    minutes.
+    """
+    utc = datetime.timezone.utc
+    by_question = defaultdict(set)
+    for question_id, minute in minutes:
+        by_question[question_id].add(minute)
+    for question_id, minutes in by_question.items():
+        for starts in _batches(minutes):
+            counted = Vote.objects.filter(
+                _ranges(starts, PERIODS[VoteRollup.MINUTE]),
+                question_id=question_id,
+            ).annotate(start=TruncMinute('created_at', tzinfo=utc)).values(
+                'choice_id', 'start').annotate(votes=Count('pk'))
+            _replace(question_id, VoteRollup.MINUTE, starts, {
+                (row['choice_id'], row['start']): row['votes']
+                for row in counted
+            })
+        for hours in _batches({bucket_start(start, VoteRollup.HOUR)
+                               for start in minutes}):
+            counted = VoteRollup.objects.filter(
+                _ranges(hours, PERIODS[VoteRollup.HOUR], field='start'),
+                question_id=question_id, period=VoteRollup.MINUTE,
+            ).annotate(hour=TruncHour('start', tzinfo=utc)).values(
+                'choice_id', 'hour').annotate(total=Sum('votes'))
+            _replace(question_id, VoteRollup.HOUR, hours, {
+                (row['choice_id'], row['hour']): row['total']
+                for row in counted
+            })
+
+
+def aggregate_votes(lag=None):
+    """
+    Recount the buckets of the votes changed since the watermark, up to
+    `lag` seconds ago so that votes still being committed are not
+    skipped, and move the watermark there. Return the number of votes
+    and buckets processed and the new watermark.
+    """
+    if lag is None:
+        lag = settings.POLLS_ROLLUP_LAG
+    until = timezone.now() - datetime.timedelta(seconds=lag)
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update(
+        ).get_or_create(name=WATERMARK)
+        changed = Vote.objects.filter(updated_at__lte=until,
+                                      created_at__isnull=False)
+        if watermark.position is not None:
+            changed = changed.filter(updated_at__gt=watermark.position)
+        votes = 0
+        minutes = set()
+        for question_id, created_at in changed.values_list(
+                'question_id', 'created_at').iterator(chunk_size=2000):
+            votes += 1
+            minutes.add((question_id,
+                         bucket_start(created_at, VoteRollup.MINUTE)))
+        recount_buckets(minutes)
+        watermark.position = until
+        watermark.save()
+    return {'votes': votes, 'buckets': len(minutes), 'watermark': until}
+
+
+def rebuild_rollups(lag=None):
+    """Drop every rollup and aggregate all the votes again."""
+    with transaction.atomic():
+        VoteRollup.objects.all().delete()
+        RollupWatermark.objects.filter(name=WATERMARK).delete()
+        return aggregate_votes(lag=lag)
+
+
+def discount_rollups(vote):
+    """
+    Remove a deleted vote from its buckets if it was aggregated since it
+    last changed. A vote changed then deleted before the next aggregation
+    stays counted under its earlier choice until the rollups are rebuilt.
+    """
+    if vote.created_at is None:
+        return
+    position = RollupWatermark.objects.filter(
+        name=WATERMARK).values_list('position', flat=True).first()
+    if position is None or vote.updated_at > position:
+        return
+    for period in PERIODS:
+        VoteRollup.objects.filter(
+            choice_id=vote.choice_id, period=period, votes__gt=0,
+            start=bucket_start(vote.created_at, period),
+        ).update(votes=F('votes') - 1)
+
+
+def vote_trend(question, period=VoteRollup.MINUTE, now=None):
+    """
+    Return the votes per choice in each of the last TREND_POINTS buckets
+    of `period` for a chart, read from the rollups.
+    """
+    length = PERIODS[period]
+    points = TREND_POINTS[period]
+    last = bucket_start(now or timezone.now(), period)
+    first = last - length * (points - 1)
+    choices = list(question.choice_set.order_by('pk').values(
+        'id', 'choice_text'))
+    counts = {
+        (choice_id, start): votes
+        for choice_id, start, votes in VoteRollup.objects.filter(
+            question=question, period=period, start__gte=first,
+        ).values_list('choice_id', 'start', 'votes')
+    }
+    buckets = []
+    for n in range(points):
+        start = first + length * n
+        votes = [counts.get((choice['id'], start), 0) for choice in choices]
+        buckets.append({'start': start.isoformat(), 'votes': votes,
+                        'total': sum(votes)})
+    return {
+        'question': {'id': question.pk,
+                     'question_text': question.question_text},
+        'period': period,
+        'choices': choices,
+        'buckets': buckets,
+    }
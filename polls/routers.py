@@ -0,0 +1,71 @@
+import contextvars
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+# set while handling a request that must read its own writes
+_use_primary = contextvars.ContextVar('polls_use_primary', default=False)
+
+
+@contextmanager
+def use_primary():
+    """Route every read inside the block to the primary database."""
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Send reads of the polls app to the read replicas and every write,
+    including those of the auth and session tables, to the primary.
+
+    Replicas are picked round-robin, or the least recently used one when
+    POLLS_REPLICA_POLICY is 'least-recent'. Reads made inside use_primary()
+    stay on the primary so a user sees the vote they just cast, and so do
+    reads inside a transaction on the primary, which writes from what it
+    reads.
+    """
+    app_label = 'polls'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cycle = None
+        self._last_used = {}
+
+    def db_for_read(self, model, **hints):
+        """Read polls models from a replica unless pinned to the primary."""
+        if model._meta.app_label != self.app_label or _use_primary.get():
+            return None
+        if connections['default'].in_atomic_block:
+            return None
+        replicas = settings.POLLS_REPLICA_DATABASES
+        if not replicas:
+            return None
+        with self._lock:
+            if settings.POLLS_REPLICA_POLICY == 'least-recent':
+                alias = min(replicas,
+                            key=lambda name: self._last_used.get(name, 0))
+                self._last_used[alias] = time.monotonic()
+                return alias
+            if self._cycle is None or self._cycle[0] != replicas:
+                self._cycle = (replicas, itertools.cycle(replicas))
+            return next(self._cycle[1])
+
+    def db_for_write(self, model, **hints):
+        """Write everything to the primary."""
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Replicas hold the same data, so any relation is allowed."""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Only migrate the primary, replicas copy its schema."""
+        return db == 'default'
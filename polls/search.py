@@ -0,0 +1,60 @@
+"""
+Full-text search of questions by their text and the text of their choices.
+
+The search index is the polls_question_search FTS5 table created by
+migration 0017 on SQLite and kept up to date by triggers. Every word of a
+search is matched as a prefix and all words must match, ranked by BM25
+with the question text weighing more than the choices. Other databases,
+or SQLite without FTS5, fall back to LIKE.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+SEARCH_TABLE = 'polls_question_search'
+
+_indexed = {}
+
+
+def search_terms(query):
+    """Return the words of a search, without any search syntax."""
+    return re.findall(r'\w+', query)
+
+
+def has_search_index(alias):
+    """Return True if database `alias` has the full-text search index."""
+    if alias not in _indexed:
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            tables = connection.introspection.table_names(cursor)
+        _indexed[alias] = SEARCH_TABLE in tables
+    return _indexed[alias]
+
+
+def search_questions(queryset, query):
+    """
+    Return the questions of `queryset` matching every word of `query`,
+    best matches first, with their relevance as `search_rank` (lower is
+    better) where the database can rank them.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+    connection = connections[queryset.db]
+    if connection.vendor == 'sqlite' and has_search_index(queryset.db):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # extra() joins the FTS5 table, which has no model, so the
+        # search drives the query and the result remains a queryset
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=[f'{SEARCH_TABLE}.rowid = polls_question.id',
+                   f'{SEARCH_TABLE} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'bm25({SEARCH_TABLE}, 2.0, 1.0)'},
+        ).order_by('search_rank', '-pub_date')
+    for term in terms:
+        queryset = queryset.filter(
+            Q(question_text__icontains=term)
+            | Q(choice__choice_text__icontains=term))
+    return queryset.distinct().order_by('-pub_date')
@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .fragments import expire_question_list
+from .live import get_results_broker
+from .models import Choice, ChoiceTallyShard, Question, Vote, VoteRollup
+from .results import invalidate_results
+from .rollups import bucket_start, discount_rollups, recount_buckets
+
+
+def expire_results(question_id):
+    """
+    Drop the cached results of a question now and again once the current
+    transaction commits, so a concurrent read cannot cache stale totals,
+    then tell the live results streams of the question.
+    """
+    invalidate_results(question_id)
+    transaction.on_commit(lambda: invalidate_results(question_id))
+    transaction.on_commit(lambda: get_results_broker().publish(question_id))
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    """Apply the SQLITE_PRAGMAS settings to a new SQLite connection."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for pragma, value in settings.SQLITE_PRAGMAS.items():
+                cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+# Votes have no delete receivers, so Django deletes the votes of a deleted
+# question, choice or user in one query instead of loading each of them.
+# Vote.delete() and the vote querysets keep the tallies right instead.
+
+def discount_deleted_vote(vote):
+    """Remove a deleted vote from the tally of its choice."""
+    if not Choice.objects.filter(pk=vote.choice_id,
+                                 vote_count__gt=0).add_votes(-1):
+        # the vote is still counted in a shard of the tally
+        ChoiceTallyShard.objects.discount_vote(vote.choice_id)
+    discount_rollups(vote)
+    Question.objects.filter(pk=vote.question_id).touch()
+    expire_results(vote.question_id)
+
+
+def counted_in(votes):
+    """
+    Return the ids of the choices and questions of `votes` and the
+    (question id, minute) rollup buckets they are counted in.
+    """
+    choice_ids, question_ids, minutes = set(), set(), set()
+    for question_id, choice_id, created_at in votes.values_list(
+            'question_id', 'choice_id', 'created_at').iterator(
+            chunk_size=2000):
+        choice_ids.add(choice_id)
+        question_ids.add(question_id)
+        if created_at is not None:
+            minutes.add((question_id,
+                         bucket_start(created_at, VoteRollup.MINUTE)))
+    return choice_ids, question_ids, minutes
+
+
+def recount_deleted_votes(choice_ids, question_ids, minutes):
+    """Recount the tallies and rollups that deleted votes were in."""
+    Choice.objects.filter(pk__in=choice_ids).recount_votes()
+    recount_buckets(minutes)
+    Question.objects.filter(pk__in=question_ids).touch()
+    for question_id in question_ids:
+        expire_results(question_id)
+
+
+@receiver(pre_delete, sender=User)
+def collect_user_votes(sender, instance, **kwargs):
+    """Note what the votes of a user about to be deleted are counted in."""
+    instance._polls_counted_in = counted_in(instance.vote_set.all())
+
+
+@receiver(post_delete, sender=User)
+def recount_user_votes(sender, instance, **kwargs):
+    """Recount the tallies the votes of a deleted user were in, once."""
+    counted = getattr(instance, '_polls_counted_in', None)
+    if counted and counted[0]:
+        recount_deleted_votes(*counted)
+
+
+@receiver(post_save, sender=Vote)
+def expire_vote_results(sender, instance, raw=False, **kwargs):
+    """Expire the cached results of the question a vote belongs to."""
+    if not raw:
+        expire_results(instance.question_id)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def expire_choice_results(sender, instance, raw=False, **kwargs):
+    """
+    Expire the cached results when the choices of a question change, and
+    mark the question changed for the conditional GETs of its pages.
+    """
+    if not raw:
+        Question.objects.filter(pk=instance.question_id).touch()
+        expire_results(instance.question_id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def expire_question_results(sender, instance, raw=False, **kwargs):
+    """Expire the cached results and question lists of a changed question."""
+    if not raw:
+        expire_results(instance.pk)
+        expire_question_list()
+        transaction.on_commit(expire_question_list)
@@ -0,0 +1,38 @@
+// Keep the results table up to date from the live results stream.
+(function () {
+    var results = document.getElementById('results');
+    if (!results || !window.EventSource) {
+        return;
+    }
+
+    function votes(count) {
+        return count + (count === 1 ? ' vote' : ' votes');
+    }
+
+    function showTotal(total) {
+        results.querySelector('.total-votes').textContent = votes(total);
+    }
+
+    function showChoice(choice) {
+        var row = results.querySelector('tr[data-choice="' + choice.id + '"]');
+        if (row) {
+            row.querySelector('.votes').textContent = votes(choice.votes);
+            row.querySelector('.percentage').textContent = choice.percentage + '%';
+        }
+    }
+
+    var stream = new EventSource(results.dataset.stream);
+    stream.addEventListener('results', function (event) {
+        var data = JSON.parse(event.data);
+        data.choices.forEach(showChoice);
+        showTotal(data.total_votes);
+    });
+    stream.addEventListener('votes', function (event) {
+        var data = JSON.parse(event.data);
+        data.choices.forEach(showChoice);
+        showTotal(data.total_votes);
+    });
+    stream.addEventListener('closed', function () {
+        stream.close();
+    });
+})();
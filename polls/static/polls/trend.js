@@ -0,0 +1,43 @@
+// Draw the votes of each recent minute or hour as bars from the rollups.
+(function () {
+    var trend = document.getElementById('trend');
+    if (!trend || !window.fetch) {
+        return;
+    }
+    var svg = trend.querySelector('svg');
+    var width = 480, height = 120;
+
+    function draw(data) {
+        var most = Math.max.apply(null, data.buckets.map(function (bucket) {
+            return bucket.total;
+        }).concat([1]));
+        var step = width / data.buckets.length;
+        svg.innerHTML = '';
+        data.buckets.forEach(function (bucket, n) {
+            var bar = document.createElementNS(svg.namespaceURI, 'rect');
+            var barHeight = height * bucket.total / most;
+            bar.setAttribute('x', n * step);
+            bar.setAttribute('y', height - barHeight);
+            bar.setAttribute('width', Math.max(step - 1, 1));
+            bar.setAttribute('height', barHeight);
+            var title = document.createElementNS(svg.namespaceURI, 'title');
+            title.textContent = bucket.start + ': ' + bucket.total;
+            bar.appendChild(title);
+            svg.appendChild(bar);
+        });
+    }
+
+    function load(period) {
+        trend.dataset.period = period;
+        fetch(trend.dataset.trend + '?period=' + period)
+            .then(function (response) { return response.json(); })
+            .then(draw);
+    }
+
+    trend.querySelectorAll('button[data-period]').forEach(function (button) {
+        button.addEventListener('click', function () {
+            load(button.dataset.period);
+        });
+    });
+    load(trend.dataset.period);
+})();
@@ -0,0 +1,144 @@
+"""
+Production serving of collected static files.
+
+Fingerprinted files are sent with immutable cache headers, precompressed
+variants are picked by Accept-Encoding, and conditional and single range
+requests are answered without reading the whole file.
+"""
+import mimetypes
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE = 'public, max-age=31536000, immutable'
+SHORT_LIVED = 'public, max-age=60'
+
+
+def _pick_variant(request, path):
+    """Return the best (path, encoding) the client accepts."""
+    accepted = request.headers.get('Accept-Encoding', '')
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def _read_range(path, start, length):
+    """Yield `length` bytes of the file at `path` starting at `start`."""
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+async def _aread_range(path, start, length):
+    """
+    Yield a range of a file under ASGI, where Django would otherwise load
+    a sync iterator into a list, reading a chunk at a time in a thread.
+    """
+    chunks = _read_range(path, start, length)
+    try:
+        while chunk := await sync_to_async(next)(chunks, b''):
+            yield chunk
+    finally:
+        chunks.close()
+
+
+def _stream_range(request, path, start, length):
+    """Return an iterator over a range of a file suited to the server."""
+    if isinstance(request, ASGIRequest):
+        return _aread_range(path, start, length)
+    return _read_range(path, start, length)
+
+
+def _parse_range(header, size):
+    """
+    Return the (start, end) of a single byte range, None if the header
+    cannot be honoured and False if the range is unsatisfiable.
+    """
+    match = RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+@require_safe
+def serve(request, path):
+    """Serve the collected static file at `path` under STATIC_ROOT."""
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except (SuspiciousFileOperation, ValueError):
+        raise Http404("Invalid static file path.")
+    if not os.path.isfile(full_path):
+        raise Http404("Static file not found.")
+
+    file_path, encoding = _pick_variant(request, full_path)
+    stat = os.stat(file_path)
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}{encoding or ""}"'
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    range_header = request.headers.get('Range')
+    if response is None and range_header and encoding is None:
+        if_range = request.headers.get('If-Range')
+        if if_range is None or if_range == etag:
+            byte_range = _parse_range(range_header, stat.st_size)
+            if byte_range is False:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+            elif byte_range is not None:
+                start, end = byte_range
+                response = StreamingHttpResponse(
+                    _stream_range(request, file_path, start, end - start + 1),
+                    status=206,
+                )
+                response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+                response['Content-Length'] = str(end - start + 1)
+    if response is None and isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            _aread_range(file_path, 0, stat.st_size))
+        response['Content-Length'] = str(stat.st_size)
+    if response is None:
+        response = FileResponse(open(file_path, 'rb'))
+        response['Content-Length'] = str(stat.st_size)
+
+    if response.status_code not in (304, 412):
+        content_type, _ = mimetypes.guess_type(full_path)
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Accept-Ranges'] = 'bytes'
+    response['Vary'] = 'Accept-Encoding'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = (IMMUTABLE if HASHED_NAME.search(path)
+                                 else SHORT_LIVED)
+    return response
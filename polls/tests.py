@@ -1,9 +1,45 @@
+import asyncio
+import csv
 import datetime
+import gzip
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
 import django.test
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.utils import ConnectionHandler, OperationalError
+from django.http import Http404, HttpResponse
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import urlsafe_base64_encode
 from django.contrib.auth.models import User
-from polls.models import Question, Choice
+from django.contrib.sessions.models import Session
+from polls.benchmark import run_benchmark, seed, vote_storm
+from polls.hashers import TunablePBKDF2PasswordHasher
+from polls.ingest import VoteQueue
+from polls.instrumentation import request_metrics
+from polls.live import ResultsBroker, get_results_broker, results_events
+from polls.loadtest import endpoints, run_loadtest
+from polls.models import (Question, Choice, ChoiceTallyShard, Vote,
+                          VoteRollup)
+from polls.middleware import ReplicaPinningMiddleware
+from polls.pagination import encode_cursor, page_before
+from polls.routers import ReplicaRouter, use_primary
+from polls.results import cached_results_by_id
+from polls.rollups import aggregate_votes, rebuild_rollups
+from polls.search import search_questions
+from polls.storage import CompressedManifestStaticFilesStorage
+from polls import staticserve
+from mysite.cache import SessionFileCache
+from mysite.database import database_config
 from mysite import settings
 from django.test import TestCase
 from django.utils import timezone
@@ -105,9 +141,11 @@ class QuestionModelTests(TestCase):
         question_1 = Question(pub_date=past)
         question_2 = Question(pub_date=past, end_date=near)
         question_3 = Question(pub_date=past, end_date=future)
-        self.assertTrue(question_1.can_vote())
-        self.assertTrue(question_2.can_vote())
-        self.assertTrue(question_3.can_vote())
+        # the clock must not pass `near` before the questions are checked
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            self.assertTrue(question_1.can_vote())
+            self.assertTrue(question_2.can_vote())
+            self.assertTrue(question_3.can_vote())
 
     def test_end_date(self):
         """
@@ -117,12 +155,31 @@ class QuestionModelTests(TestCase):
         now = timezone.now()
         past = now - datetime.timedelta(days=10)
         near = now + datetime.timedelta(seconds=0.0001)
-        question_1 = Question(end_date=past)
-        question_2 = Question(end_date=now)
-        question_3 = Question(end_date=near)
-        self.assertFalse(question_1.can_vote())
-        self.assertFalse(question_2.can_vote())
-        self.assertTrue(question_3.can_vote())
+        # published now, as by default, on a clock that stops at `now`
+        # so it cannot pass `near` before the questions are checked
+        question_1 = Question(pub_date=now, end_date=past)
+        question_2 = Question(pub_date=now, end_date=now)
+        question_3 = Question(pub_date=now, end_date=near)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            self.assertFalse(question_1.can_vote())
+            self.assertFalse(question_2.can_vote())
+            self.assertTrue(question_3.can_vote())
+
+
+class FixtureTests(TestCase):
+
+    def test_load_fixtures(self):
+        """The documented fixtures load into a freshly migrated database."""
+        data = settings.BASE_DIR / 'data'
+        for fixtures in (['polls_no_votes.json'],
+                         ['polls.json', 'users.json']):
+            with self.subTest(fixtures=fixtures):
+                call_command('loaddata', *[data / name for name in fixtures],
+                             verbosity=0)
+        self.assertTrue(Vote.objects.filter(created_at__isnull=False,
+                                            updated_at__isnull=False).exists())
+        for choice in Choice.objects.all():
+            self.assertEqual(choice.vote_count, choice.vote_set.count())
 
 
 def create_question(question_text, days):
@@ -135,6 +192,81 @@ def create_question(question_text, days):
     return Question.objects.create(question_text=question_text, pub_date=time)
 
 
+class QuestionQuerySetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now()
+        tick = datetime.timedelta(microseconds=1)
+        day = datetime.timedelta(days=1)
+        # (pub_date, end_date) on either side of every boundary
+        windows = [
+            (cls.now - day, None),
+            (cls.now, None),
+            (cls.now + tick, None),
+            (cls.now - day, cls.now - tick),
+            (cls.now - day, cls.now),
+            (cls.now - day, cls.now + tick),
+            (cls.now, cls.now),
+            (cls.now + tick, cls.now + day),
+            (cls.now - day - tick, None),
+        ]
+        cls.questions = [
+            Question.objects.create(question_text=f"Window {n}.",
+                                    pub_date=pub_date, end_date=end_date)
+            for n, (pub_date, end_date) in enumerate(windows)
+        ]
+
+    def assertSelects(self, queryset, method):
+        """The queryset selects exactly the questions `method` accepts."""
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            self.assertEqual(
+                set(queryset.values_list('pk', flat=True)),
+                {question.pk for question in self.questions
+                 if getattr(question, method)()})
+
+    def test_published(self):
+        """published() agrees with is_published() at pub_date."""
+        self.assertSelects(Question.objects.published(self.now),
+                           'is_published')
+
+    def test_open_now(self):
+        """open_now() agrees with can_vote() at pub_date and end_date."""
+        self.assertSelects(Question.objects.open_now(self.now), 'can_vote')
+
+    def test_closed(self):
+        """closed() selects the published questions that can't be voted."""
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            self.assertEqual(
+                set(Question.objects.closed(self.now)),
+                {question for question in self.questions
+                 if question.is_published() and not question.can_vote()})
+
+    def test_recent(self):
+        """recent() agrees with was_published_recently() at both ends."""
+        self.assertSelects(Question.objects.recent(self.now),
+                           'was_published_recently')
+
+    def test_defaults_to_now(self):
+        """Without a time the filters compare with timezone.now()."""
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            self.assertEqual(Question.objects.open_now().count(),
+                             Question.objects.open_now(self.now).count())
+
+    def test_with_status(self):
+        """with_status() annotates each question as its methods classify it."""
+        for question in Question.objects.with_status(self.now):
+            with mock.patch('django.utils.timezone.now',
+                            return_value=self.now):
+                if question.can_vote():
+                    expected = 'open'
+                elif question.is_published():
+                    expected = 'closed'
+                else:
+                    expected = 'scheduled'
+            self.assertEqual(question.status, expected, question)
+
+
 class QuestionIndexViewTests(TestCase):
     def test_no_questions(self):
         """
@@ -192,6 +324,209 @@ class QuestionIndexViewTests(TestCase):
             [question2, question1],
         )
 
+    @django.test.override_settings(POLLS_INDEX_PAGE_SIZE=2)
+    def test_keyset_pagination(self):
+        """
+        The index page lists a page of questions and links to the next
+        page with a cursor that continues after the last listed question.
+        """
+        questions = [create_question(question_text=f"Question {n}.", days=-n)
+                     for n in range(1, 6)]
+        response = self.client.get(reverse('polls:index'))
+        self.assertEqual(list(response.context['latest_question_list']),
+                         questions[:2])
+        cursor = response.context['next_cursor']
+        response = self.client.get(reverse('polls:index'),
+                                   {'before': cursor})
+        self.assertEqual(list(response.context['latest_question_list']),
+                         questions[2:4])
+        response = self.client.get(reverse('polls:index'),
+                                   {'before': response.context['next_cursor']})
+        self.assertEqual(list(response.context['latest_question_list']),
+                         questions[4:])
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_status(self):
+        """Each question of the index shows whether it is open or closed."""
+        create_question(question_text="Open.", days=-2)
+        closed = create_question(question_text="Closed.", days=-3)
+        closed.end_date = timezone.now() - datetime.timedelta(days=1)
+        closed.save()
+        response = self.client.get(reverse('polls:index'))
+        self.assertEqual(
+            [question.status
+             for question in response.context['latest_question_list']],
+            ['open', 'closed'])
+        self.assertContains(response, '<td class="status closed"', html=False)
+
+    def test_invalid_cursor(self):
+        """A malformed, out of range or future cursor returns 404."""
+        now = timezone.now()
+        for cursor in ('not-a-cursor',
+                       f'{now.isoformat()}|{2 ** 64}',
+                       f'{now.replace(tzinfo=None).isoformat()}|1',
+                       f'{(now + datetime.timedelta(days=1)).isoformat()}|1'):
+            with self.subTest(cursor=cursor):
+                if '|' in cursor:
+                    cursor = urlsafe_base64_encode(cursor.encode())
+                response = self.client.get(reverse('polls:index'),
+                                           {'before': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_deep_page_seeks_to_the_cursor(self):
+        """A page deep in the index costs about as much as the first one."""
+        if connection.vendor != 'sqlite':
+            self.skipTest("counts SQLite virtual machine steps")
+        now = timezone.now()
+        Question.objects.bulk_create([
+            Question(question_text=f"Question {n}.",
+                     pub_date=now - datetime.timedelta(minutes=n))
+            for n in range(500)])
+        questions = Question.objects.with_status()
+        deep = questions.order_by('-pub_date', '-id')[480]
+
+        def steps(cursor):
+            """Return the SQLite steps of loading the page after `cursor`."""
+            counted = [0]
+
+            def count():
+                counted[0] += 1
+
+            connection.ensure_connection()
+            connection.connection.set_progress_handler(count, 1)
+            try:
+                page_before(questions, cursor, 10)
+            finally:
+                connection.connection.set_progress_handler(None, 1)
+            return counted[0]
+
+        self.assertLess(steps(encode_cursor(deep)), 2 * steps(None))
+
+
+class QuestionSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.donut = create_question(question_text="Which donut brand?",
+                                    days=-2)
+        Choice.objects.create(question=cls.donut, choice_text="Krispy Kreme")
+        cls.coffee = create_question(question_text="Morning drink?",
+                                     days=-1)
+        Choice.objects.create(question=cls.coffee, choice_text="Coffee")
+        Choice.objects.create(question=cls.coffee, choice_text="Donut shake")
+
+    def search(self, query):
+        """Return the texts of the published questions matching `query`."""
+        questions = Question.objects.filter(pub_date__lte=timezone.now())
+        return [question.question_text
+                for question in search_questions(questions, query)]
+
+    def test_prefix_matching(self):
+        """Every word of a search matches as a prefix."""
+        self.assertEqual(self.search("kris"), ["Which donut brand?"])
+        self.assertEqual(self.search("morn cof"), ["Morning drink?"])
+        self.assertEqual(self.search("morn krispy"), [])
+
+    def test_question_text_ranks_first(self):
+        """A match in the question ranks above a match in a choice."""
+        self.assertEqual(self.search("donut"),
+                         ["Which donut brand?", "Morning drink?"])
+
+    def test_search_syntax_is_ignored(self):
+        """Operators and quotes of the search engine are plain text."""
+        self.assertEqual(self.search('"donut" OR NOT*'), [])
+        self.assertEqual(self.search('  ?! '), [])
+
+    def test_index_follows_edits(self):
+        """Renamed questions and deleted choices are searched as they are."""
+        self.coffee.question_text = "Evening drink?"
+        self.coffee.save()
+        Choice.objects.filter(choice_text="Coffee").delete()
+        self.assertEqual(self.search("morning"), [])
+        self.assertEqual(self.search("coffee"), [])
+        self.assertEqual(self.search("evening shake"), ["Evening drink?"])
+
+    def test_bulk_inserts_are_indexed(self):
+        """Rows inserted without signals, as by import_polls, are found."""
+        question, = Question.objects.bulk_create(
+            [Question(question_text="Bulk loaded?", pub_date=timezone.now())])
+        Choice.objects.bulk_create([Choice(question=question,
+                                           choice_text="Imported")])
+        self.assertEqual(self.search("import"), ["Bulk loaded?"])
+
+    def test_like_fallback(self):
+        """Without a search index the search uses LIKE."""
+        with mock.patch('polls.search.has_search_index', return_value=False):
+            self.assertEqual(self.search("donut"),
+                             ["Morning drink?", "Which donut brand?"])
+
+    def test_index_search(self):
+        """The q parameter of the index shows the matching polls."""
+        response = self.client.get(reverse('polls:index'), {'q': 'coff'})
+        self.assertQuerysetEqual(response.context['latest_question_list'],
+                                 [self.coffee])
+        response = self.client.get(reverse('polls:index'), {'q': 'tea'})
+        self.assertContains(response, "No polls match your search.")
+
+    async def test_async_index_search(self):
+        """The async index supports the same search."""
+        response = await self.async_client.get(reverse('polls:async_index'),
+                                               {'q': 'krispy'})
+        self.assertContains(response, "Which donut brand?")
+        self.assertNotContains(response, "Morning drink?")
+
+    def test_admin_search(self):
+        """The admin changelist searches the full-text index."""
+        staff = User.objects.create_user(username="admin", is_staff=True,
+                                         is_superuser=True)
+        self.client.force_login(staff)
+        response = self.client.get(
+            reverse('admin:polls_question_changelist'), {'q': 'krisp'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.donut])
+
+
+class TemplateFragmentTests(TestCase):
+
+    def test_header_varies_on_user(self):
+        """The cached header is not shared between users."""
+        self.client.get(reverse('polls:index'))
+        user = User.objects.create_user(username="tester")
+        self.client.force_login(user)
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Hello, Tester")
+        self.assertNotContains(response, "Please <a")
+
+    def test_question_list_expires_on_new_question(self):
+        """A new question shows up despite the cached question list."""
+        create_question(question_text="First.", days=-2)
+        self.client.get(reverse('polls:index'))
+        create_question(question_text="Second.", days=-1)
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Second.")
+
+    def test_question_list_shows_polls_closing(self):
+        """A poll closing is shown despite the cached question list."""
+        question = create_question(question_text="Closing.", days=-2)
+        question.end_date = timezone.now() + datetime.timedelta(hours=1)
+        question.save()
+        self.assertContains(self.client.get(reverse('polls:index')),
+                            '<td class="status open"')
+        later = timezone.now() + datetime.timedelta(hours=2)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, '<td class="status closed"')
+
+    def test_pages_share_the_base_template(self):
+        """Every polls page extends the shared base template."""
+        question = create_question(question_text="Shared.", days=-1)
+        for url in (reverse('polls:index'),
+                    reverse('polls:detail', args=(question.id,)),
+                    reverse('polls:results', args=(question.id,))):
+            response = self.client.get(url)
+            self.assertTemplateUsed(response, 'polls/base.html')
+            self.assertContains(response, "KU-POLLS")
+
 
 class QuestionDetailViewTests(TestCase):
     def test_future_question(self):
@@ -216,26 +551,61 @@ class QuestionDetailViewTests(TestCase):
         response = self.client.get(url)
         self.assertContains(response, past_question.question_text)
 
+    def test_closed_question(self):
+        """
+        The detail view of a question whose voting period just ended
+        redirects to the index with a message.
+        """
+        question = create_question(question_text='Ended.', days=-5)
+        question.end_date = timezone.now()
+        question.save()
+        with mock.patch('django.utils.timezone.now',
+                        return_value=question.end_date):
+            response = self.client.get(
+                reverse('polls:detail', args=(question.id,)), follow=True)
+        self.assertRedirects(response, reverse('polls:index'))
+        self.assertContains(response, "This poll is currently closed.")
+
+    def test_query_budget(self):
+        """
+        The detail page loads the question and its choices in two queries,
+        and a logged in user's previous vote comes with the question.
+        """
+        question = create_question(question_text='Budget.', days=-1)
+        choices = [Choice.objects.create(question=question,
+                                         choice_text=f"Choice {n}")
+                   for n in range(5)]
+        url = reverse('polls:detail', args=(question.id,))
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        user = User.objects.create_user(username="voter")
+        Vote.objects.cast(user, choices[3])
+        self.client.force_login(user)
+        # plus one query for the user, the session comes from the cache
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.context['previously_selected'], choices[3])
+
 
 class UserAuthTest(django.test.TestCase):
 
-    def setUp(self):
-        super().setUp()
-        self.username = "testuser"
-        self.password = "FatChance!"
-        self.user1 = User.objects.create_user(
-            username=self.username,
-            password=self.password,
+    @classmethod
+    def setUpTestData(cls):
+        cls.username = "testuser"
+        cls.password = "FatChance!"
+        cls.user1 = User.objects.create_user(
+            username=cls.username,
+            password=cls.password,
             email="testuser@nowhere.com"
         )
-        self.user1.first_name = "Tester"
-        self.user1.save()
+        cls.user1.first_name = "Tester"
+        cls.user1.save()
         q = Question.objects.create(question_text="First Poll Question")
         q.save()
         for n in range(1, 4):
             choice = Choice(choice_text=f"Choice {n}", question=q)
             choice.save()
-        self.question = q
+        cls.question = q
 
     def test_logout(self):
         """A user can logout using the logout url.
@@ -265,6 +635,31 @@ class UserAuthTest(django.test.TestCase):
         self.assertEqual(302, response.status_code)
         self.assertRedirects(response, reverse(settings.LOGIN_REDIRECT_URL))
 
+    def test_signup_logs_in_without_rehashing(self):
+        """
+        Signing up creates the user and logs them in without checking
+        the password that was just hashed.
+        """
+        form_data = {"username": "newcomer",
+                     "password1": "Unusual-Pass-42",
+                     "password2": "Unusual-Pass-42"}
+        with mock.patch('django.contrib.auth.base_user.check_password') \
+                as check_password:
+            response = self.client.post(reverse('signup'), form_data)
+        self.assertRedirects(response, reverse('polls:index'))
+        check_password.assert_not_called()
+        user = User.objects.get(username="newcomer")
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.pk)
+        self.assertTrue(user.check_password("Unusual-Pass-42"))
+
+    @django.test.override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_tunable_hasher_cost(self):
+        """The PBKDF2 iterations come from the settings."""
+        hasher = TunablePBKDF2PasswordHasher()
+        encoded = hasher.encode("FatChance!", hasher.salt())
+        self.assertTrue(encoded.startswith("pbkdf2_sha256$1000$"))
+        self.assertTrue(hasher.verify("FatChance!", encoded))
+
     def test_auth_required_to_vote(self):
         """Authentication is required to submit a vote.
 
@@ -280,3 +675,1321 @@ class UserAuthTest(django.test.TestCase):
         self.assertEqual(response.status_code, 302)
         login_with_next = f"{reverse('login')}?next={vote_url}"
         self.assertRedirects(response, login_with_next)
+
+
+class VoteTallyTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="voter",
+                                            password="FatChance!")
+        cls.question = create_question(question_text="Tally", days=-1)
+        cls.choice1 = Choice.objects.create(question=cls.question,
+                                            choice_text="One")
+        cls.choice2 = Choice.objects.create(question=cls.question,
+                                            choice_text="Two")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def vote_for(self, choice):
+        """Submit a vote for `choice` as the logged in user."""
+        return self.client.post(reverse('polls:vote',
+                                        args=(self.question.id,)),
+                                {"choice": choice.id})
+
+    def test_new_vote_is_counted(self):
+        """A new vote increments the tally of the selected choice."""
+        self.vote_for(self.choice1)
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 1)
+
+    def test_changed_vote_moves_tally(self):
+        """Switching a vote moves one count to the new choice."""
+        self.vote_for(self.choice1)
+        self.vote_for(self.choice2)
+        self.vote_for(self.choice2)
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 0)
+        self.assertEqual(self.choice2.votes, 1)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_one_vote_per_user_per_question(self):
+        """The database rejects a second vote of a user in a question."""
+        Vote.objects.create(user=self.user, choice=self.choice1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Vote.objects.create(user=self.user, choice=self.choice2)
+
+    def test_changed_vote_updates_its_row(self):
+        """
+        Changing a vote updates its one row, recorded against the question,
+        within a fixed budget of queries.
+        """
+        self.vote_for(self.choice1)
+        # the user, question and choice, then in a savepoint the locked
+        # vote, both tallies, the vote and the question's updated_at
+        with self.assertNumQueries(10) as context:
+            self.vote_for(self.choice2)
+        self.assertEqual(
+            [query['sql'].split()[0] for query in context.captured_queries
+             if query['sql'].startswith(('INSERT INTO "polls_vote"',
+                                         'UPDATE "polls_vote"',
+                                         'DELETE FROM "polls_vote"'))],
+            ['UPDATE'])
+        vote = Vote.objects.get(user=self.user)
+        self.assertEqual(vote.question, self.question)
+        self.assertEqual(vote.choice, self.choice2)
+
+    def test_deleted_vote_is_discounted(self):
+        """Deleting a vote removes it from the tally."""
+        self.vote_for(self.choice1)
+        Vote.objects.all().delete()
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 0)
+
+    def test_deleted_user_is_discounted(self):
+        """Deleting a user recounts the tallies of their votes."""
+        other = User.objects.create_user(username="other")
+        Vote.objects.cast(self.user, self.choice1)
+        Vote.objects.cast(other, self.choice1)
+        other.delete()
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 1)
+
+    def test_cascade_deletes_votes_in_one_query(self):
+        """Deleting a question costs the same however many votes it has."""
+        queries = []
+        for voters in (1, 5):
+            question = create_question(question_text="Gone?", days=-1)
+            choice = Choice.objects.create(question=question,
+                                           choice_text="Yes")
+            for n in range(voters):
+                user = User.objects.create_user(username=f"gone{voters}-{n}")
+                Vote.objects.cast(user, choice)
+            with CaptureQueriesContext(connection) as context:
+                question.delete()
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_rebuild_vote_counts(self):
+        """The management command rebuilds tallies from the Vote table."""
+        Vote.objects.create(user=self.user, choice=self.choice2)
+        call_command('rebuild_vote_counts', stdout=StringIO())
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 0)
+        self.assertEqual(self.choice2.votes, 1)
+
+    def test_rebuild_expires_the_results(self):
+        """Rebuilt tallies are shown at once, not a cached old total."""
+        url = reverse('polls:results', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        Vote.objects.create(user=self.user, choice=self.choice2)
+        call_command('rebuild_vote_counts', self.question.id,
+                     stdout=StringIO())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['results']['total_votes'], 1)
+
+    def test_results_query_count(self):
+        """The results page does not count votes per choice."""
+        for n in range(3, 10):
+            Choice.objects.create(question=self.question,
+                                  choice_text=f"Choice {n}")
+        self.client.logout()
+        url = reverse('polls:results', args=(self.question.id,))
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+
+class QuestionResultsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = create_question(question_text="Results", days=-1)
+        cls.choice1 = Choice.objects.create(question=cls.question,
+                                            choice_text="One")
+        cls.choice2 = Choice.objects.create(question=cls.question,
+                                            choice_text="Two")
+        for n in range(3):
+            user = User.objects.create_user(username=f"voter{n}")
+            choice = cls.choice1 if n else cls.choice2
+            Vote.objects.cast(user, choice)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_results_json(self):
+        """The JSON endpoint reports totals and percentages per choice."""
+        url = reverse('polls:results_json', args=(self.question.id,))
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        data = response.json()
+        self.assertEqual(data['total_votes'], 3)
+        self.assertEqual(
+            [(c['choice_text'], c['votes'], c['percentage'])
+             for c in data['choices']],
+            [("One", 2, 66.7), ("Two", 1, 33.3)],
+        )
+
+    def test_results_without_votes(self):
+        """A question without votes reports zero percent for each choice."""
+        Vote.objects.all().delete()
+        url = reverse('polls:results_json', args=(self.question.id,))
+        data = self.client.get(url).json()
+        self.assertEqual(data['total_votes'], 0)
+        self.assertEqual([c['percentage'] for c in data['choices']],
+                         [0.0, 0.0])
+
+    def test_results_page_shows_totals(self):
+        """The results page renders the aggregated totals."""
+        url = reverse('polls:results', args=(self.question.id,))
+        response = self.client.get(url)
+        self.assertContains(response, "66.7%")
+        self.assertContains(response, "3 votes")
+
+    def test_results_are_cached(self):
+        """Repeated reads of the results are served from the cache."""
+        url = reverse('polls:results_json', args=(self.question.id,))
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['total_votes'], 3)
+
+    def test_vote_invalidates_cached_results(self):
+        """A new vote expires the cached results of its question."""
+        url = reverse('polls:results_json', args=(self.question.id,))
+        self.client.get(url)
+        user = User.objects.create_user(username="latecomer")
+        self.client.force_login(user)
+        self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                         {"choice": self.choice2.id})
+        self.assertEqual(self.client.get(url).json()['total_votes'], 4)
+
+    def test_choice_change_invalidates_cached_results(self):
+        """Editing the choices of a question expires its cached results."""
+        url = reverse('polls:results_json', args=(self.question.id,))
+        self.client.get(url)
+        Choice.objects.create(question=self.question, choice_text="Three")
+        self.assertEqual(len(self.client.get(url).json()['choices']), 3)
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = create_question(question_text="Etag", days=-1)
+        cls.choice = Choice.objects.create(question=cls.question,
+                                           choice_text="Yes")
+        cls.user = User.objects.create_user(username="voter")
+
+    def setUp(self):
+        cache.clear()
+
+    def assertNotModified(self, url):
+        """A repeated GET with the returned ETag gets 304 Not Modified."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        return response['ETag']
+
+    def test_unchanged_pages_are_not_modified(self):
+        """Index, results page and JSON results answer 304 when unchanged."""
+        for url in (reverse('polls:index'),
+                    reverse('polls:results', args=(self.question.id,)),
+                    reverse('polls:results_json', args=(self.question.id,))):
+            with self.subTest(url=url):
+                self.assertNotModified(url)
+
+    def test_not_modified_skips_the_results(self):
+        """A 304 on the results page costs a single query."""
+        url = reverse('polls:results', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_vote_changes_the_etag(self):
+        """A vote makes the earlier ETags stale."""
+        urls = [reverse('polls:index'),
+                reverse('polls:results', args=(self.question.id,)),
+                reverse('polls:results_json', args=(self.question.id,))]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        Vote.objects.cast(self.user, self.choice)
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_choice_change_changes_the_etag(self):
+        """Adding a choice makes the earlier results ETag stale."""
+        url = reverse('polls:results', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        Choice.objects.create(question=self.question, choice_text="Maybe")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Maybe")
+
+    def test_etag_varies_by_user(self):
+        """The pages show who is logged in, so the ETag depends on it."""
+        url = reverse('polls:results', args=(self.question.id,))
+        anonymous = self.client.get(url)['ETag']
+        self.client.force_login(self.user)
+        self.assertNotEqual(self.client.get(url)['ETag'], anonymous)
+
+    def test_pending_messages_disable_not_modified(self):
+        """A page with a message to show is always rendered."""
+        url = reverse('polls:results', args=(self.question.id,))
+        self.client.force_login(self.user)
+        etag = self.client.get(url)['ETag']
+        self.client.get(reverse('polls:vote', args=(self.question.id,)))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ResultsStreamTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = create_question(question_text="Live", days=-1)
+        cls.yes = Choice.objects.create(question=cls.question,
+                                        choice_text="Yes")
+        cls.no = Choice.objects.create(question=cls.question,
+                                       choice_text="No")
+        cls.user = User.objects.create_user(username="watcher")
+        cls.url = reverse('polls:results_stream', args=(cls.question.id,))
+
+    def setUp(self):
+        cache.clear()
+
+    def cast_vote(self):
+        """Vote and run the on-commit hooks as a real commit would."""
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.cast(self.user, self.yes)
+
+    async def test_stream_starts_with_the_results(self):
+        """Under ASGI the stream opens with the current results."""
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.streaming_content
+        first = await anext(content)
+        await content.aclose()
+        self.assertIn(b'event: results', first)
+        self.assertIn(b'"total_votes": 0', first)
+
+    def test_wsgi_sends_a_snapshot(self):
+        """A WSGI server gets the results once and the browser polls."""
+        response = self.client.get(self.url)
+        self.assertFalse(response.streaming)
+        self.assertContains(response, 'event: results')
+        self.assertContains(response, 'retry: ')
+
+    def test_missing_question(self):
+        """Streaming the results of an unknown question gives 404."""
+        response = self.client.get(reverse('polls:results_stream',
+                                           args=(self.question.id + 1,)))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_vote_pushes_deltas(self):
+        """A vote is pushed to the watchers as a delta of the counts."""
+        broker = get_results_broker()
+        events = results_events(broker, self.question.id, keepalive=5)
+        await anext(events)
+        await sync_to_async(self.cast_vote)()
+        update = await asyncio.wait_for(anext(events), 5)
+        self.assertIn('event: votes', update)
+        data = json.loads(update.split('data: ', 1)[1])
+        self.assertEqual(data['total_votes'], 1)
+        self.assertEqual(data['choices'][0]['id'], self.yes.id)
+        self.assertEqual(data['choices'][0]['delta'], 1)
+        await events.aclose()
+        self.assertEqual(broker.metrics()['subscribers'], 0)
+
+    async def test_updates_are_coalesced(self):
+        """A burst of changes costs a single reload of the results."""
+        broker = ResultsBroker(max_rate=1000)
+        subscription = broker.subscribe(self.question.id)
+        for _ in range(50):
+            broker.publish(self.question.id)
+        results = await asyncio.wait_for(subscription.next_results(), 5)
+        self.assertEqual(results['question']['id'], self.question.id)
+        self.assertEqual(broker.reloads, 1)
+        broker.unsubscribe(subscription)
+
+    async def test_slow_watcher_only_gets_the_latest(self):
+        """A watcher that falls behind skips to the latest results."""
+        broker = ResultsBroker(max_rate=1000)
+        fast = broker.subscribe(self.question.id)
+        slow = broker.subscribe(self.question.id)
+        for _ in range(3):
+            broker.publish(self.question.id)
+            await asyncio.wait_for(fast.next_results(), 5)
+        self.assertEqual(broker.reloads, 3)
+        await asyncio.wait_for(slow.next_results(), 5)
+        with self.assertRaises(asyncio.TimeoutError):
+            await slow.next_results(0.05)
+        broker.unsubscribe(fast)
+        broker.unsubscribe(slow)
+
+
+class PollTransferTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = create_question(question_text="Export?", days=-1)
+        cls.question.end_date = timezone.now() + datetime.timedelta(days=1)
+        cls.question.save()
+        cls.yes = Choice.objects.create(question=cls.question,
+                                        choice_text="Yes, \"quoted\"")
+        cls.no = Choice.objects.create(question=cls.question,
+                                       choice_text="No")
+        for n in range(3):
+            user = User.objects.create_user(username=f"porter{n}")
+            Vote.objects.cast(user, cls.yes if n else cls.no)
+        cls.voted_at = set(Vote.objects.values_list('created_at', flat=True))
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def round_trip(self, name):
+        """Export the polls to `name`, delete them and import the file."""
+        path = str(Path(self.directory.name) / name)
+        call_command('export_polls', output=path, stderr=StringIO())
+        Question.objects.all().delete()
+        call_command('import_polls', path, batch_size=2, stdout=StringIO())
+        return Question.objects.get()
+
+    def assertImported(self, question):
+        """The imported question matches the exported one."""
+        self.assertEqual(question.question_text, "Export?")
+        self.assertEqual(question.end_date, self.question.end_date)
+        self.assertEqual(
+            list(question.choice_set.order_by('pk').values_list(
+                'choice_text', 'vote_count')),
+            [('Yes, "quoted"', 2), ('No', 1)])
+        self.assertEqual(
+            set(Vote.objects.values_list('user__username',
+                                         'choice__choice_text')),
+            {('porter0', 'No'), ('porter1', 'Yes, "quoted"'),
+             ('porter2', 'Yes, "quoted"')})
+        self.assertEqual(
+            set(Vote.objects.values_list('created_at', flat=True)),
+            self.voted_at)
+
+    def test_jsonl_round_trip(self):
+        """Polls survive an export and import as JSON Lines."""
+        self.assertImported(self.round_trip('polls.jsonl'))
+
+    def test_compressed_csv_round_trip(self):
+        """Polls survive an export and import as compressed CSV."""
+        self.assertImported(self.round_trip('polls.csv.gz'))
+
+    def test_export_to_stdout(self):
+        """Without a file the records are written to standard output."""
+        out = StringIO()
+        call_command('export_polls', self.question.id, stdout=out,
+                     stderr=StringIO())
+        models = [json.loads(line)['model']
+                  for line in out.getvalue().splitlines()]
+        self.assertEqual(models, ['question', 'choice', 'choice',
+                                  'vote', 'vote', 'vote'])
+
+    def test_import_unknown_user(self):
+        """Votes of unknown users are refused unless they are created."""
+        path = Path(self.directory.name) / 'polls.jsonl'
+        call_command('export_polls', output=str(path), stderr=StringIO())
+        User.objects.filter(username='porter0').delete()
+        with self.assertRaisesMessage(CommandError, "'porter0'"):
+            call_command('import_polls', str(path), stdout=StringIO())
+        call_command('import_polls', str(path), create_users=True,
+                     stdout=StringIO())
+        self.assertFalse(User.objects.get(
+            username='porter0').has_usable_password())
+
+    def test_import_unknown_question(self):
+        """A choice of a question missing from the file is refused."""
+        path = Path(self.directory.name) / 'polls.jsonl'
+        path.write_text(json.dumps({'model': 'choice', 'id': 1,
+                                    'question': 99, 'choice_text': "?"}))
+        with self.assertRaisesMessage(CommandError, "Record 1"):
+            call_command('import_polls', str(path), stdout=StringIO())
+        self.assertEqual(Choice.objects.count(), 2)
+
+    def test_import_choice_of_another_question(self):
+        """A vote for a choice of another question is refused."""
+        path = Path(self.directory.name) / 'polls.jsonl'
+        records = [
+            {'model': 'question', 'id': 1, 'question_text': "First?",
+             'pub_date': '2024-01-01T00:00:00+00:00'},
+            {'model': 'question', 'id': 2, 'question_text': "Second?",
+             'pub_date': '2024-01-01T00:00:00+00:00'},
+            {'model': 'choice', 'id': 1, 'question': 2, 'choice_text': "?"},
+            {'model': 'vote', 'question': 1, 'choice': 1, 'user': 'porter0'},
+        ]
+        path.write_text(''.join(json.dumps(record) + '\n'
+                                for record in records))
+        with self.assertRaisesMessage(CommandError, "Record 4"):
+            call_command('import_polls', str(path), stdout=StringIO())
+        self.assertEqual(Question.objects.count(), 1)
+        self.assertEqual(Vote.objects.count(), 3)
+
+
+class ResultsExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = create_question(question_text="Report?", days=-5)
+        cls.other = create_question(question_text="Other?", days=-1)
+        cls.yes = Choice.objects.create(question=cls.question,
+                                        choice_text="Yes")
+        cls.no = Choice.objects.create(question=cls.question,
+                                       choice_text="No")
+        for n in range(3):
+            user = User.objects.create_user(username=f"reporter{n}")
+            Vote.objects.cast(user, cls.yes if n else cls.no)
+        cls.staff = User.objects.create_user(username="admin", is_staff=True,
+                                             is_superuser=True)
+        cls.url = reverse('polls:export_results')
+
+    def test_export_is_staff_only(self):
+        """Only staff can download the raw votes."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_csv_export(self):
+        """The CSV has a row per choice tally and a row per vote."""
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url, {'question': self.question.id})
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode()
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual([(row['row'], row['choice_text'], row['votes'])
+                          for row in rows if row['row'] == 'tally'],
+                         [('tally', 'Yes', '2'), ('tally', 'No', '1')])
+        self.assertEqual(sorted((row['user'], row['choice_text'])
+                                for row in rows if row['row'] == 'vote'),
+                         [('reporter0', 'No'), ('reporter1', 'Yes'),
+                          ('reporter2', 'Yes')])
+
+    def test_json_export(self):
+        """The JSON export of all questions is one document."""
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url, {'format': 'json'})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data['tallies']), 2)
+        self.assertEqual(len(data['votes']), 3)
+        self.assertTrue(all(vote['voted_at'] and vote['changed_at']
+                            for vote in data['votes']))
+
+    def test_invalid_parameters(self):
+        """Unknown formats and malformed question ids give 404."""
+        self.client.force_login(self.staff)
+        for params in ({'format': 'xml'}, {'question': 'one'}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 404)
+
+    def test_admin_action(self):
+        """The admin can export the selected questions."""
+        self.client.force_login(self.staff)
+        response = self.client.post(
+            reverse('admin:polls_question_changelist'),
+            {'action': 'export_results_csv',
+             '_selected_action': [self.other.id]})
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content.splitlines()[1:], [])
+
+    async def test_asgi_export_streams_asynchronously(self):
+        """Under ASGI the export is not read into memory first."""
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        response = await self.async_client.get(self.url)
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in
+                            response.streaming_content])
+        self.assertEqual(content.count(b'\nvote,'), 3)
+
+
+class VoteQueueTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = create_question(question_text="Storm", days=-1)
+        cls.choice1 = Choice.objects.create(question=cls.question,
+                                            choice_text="One")
+        cls.choice2 = Choice.objects.create(question=cls.question,
+                                            choice_text="Two")
+        cls.users = [User.objects.create_user(username=f"voter{n}")
+                     for n in range(5)]
+
+    def setUp(self):
+        self.queue = VoteQueue(batch_size=2, max_size=10, autostart=False)
+
+    def test_flush_writes_batches(self):
+        """Queued votes are upserted in batches and counted."""
+        for user in self.users:
+            self.queue.submit(user.pk, self.question.pk, self.choice1.pk)
+        self.assertEqual(self.queue.depth, 5)
+        self.assertEqual(self.queue.flush(), 5)
+        self.assertEqual(self.queue.depth, 0)
+        self.assertEqual(self.queue.metrics()['flushes'], 3)
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 5)
+
+    def test_flush_switches_existing_votes(self):
+        """A queued vote replaces the earlier vote of the same user."""
+        Vote.objects.cast(self.users[0], self.choice1)
+        self.queue.submit(self.users[0].pk, self.question.pk, self.choice1.pk)
+        self.queue.submit(self.users[0].pk, self.question.pk, self.choice2.pk)
+        self.queue.flush()
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual((self.choice1.votes, self.choice2.votes), (0, 1))
+        self.assertEqual(Vote.objects.get(user=self.users[0]).choice,
+                         self.choice2)
+
+    def test_failed_flush_keeps_the_votes(self):
+        """Votes of a batch that cannot be written are retried later."""
+        for user in self.users:
+            self.queue.submit(user.pk, self.question.pk, self.choice1.pk)
+        write = self.queue._write
+
+        def write_single_votes(batch):
+            if len(batch) > 1:
+                raise OperationalError("database is locked")
+            write(batch)
+
+        with mock.patch.object(self.queue, '_write', side_effect=(
+                OperationalError("database is locked"))), \
+                self.assertLogs('polls.ingest', 'ERROR'):
+            self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(self.queue.depth, 5)
+        self.assertEqual(self.queue.metrics()['failures'], 1)
+        # a batch failing as a whole is written one vote at a time
+        with mock.patch.object(self.queue, '_write',
+                               side_effect=write_single_votes), \
+                self.assertLogs('polls.ingest', 'ERROR'):
+            self.assertEqual(self.queue.flush(), 5)
+        self.assertEqual(self.queue.depth, 0)
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 5)
+
+    def test_full_queue_rejects_votes(self):
+        """A full queue refuses votes so the caller writes them directly."""
+        small = VoteQueue(max_size=1, autostart=False)
+        self.assertTrue(small.submit(1, self.question.pk, self.choice1.pk))
+        self.assertFalse(small.submit(2, self.question.pk, self.choice1.pk))
+
+    def test_vote_view_queues_votes(self):
+        """With write-behind enabled the vote view queues the vote."""
+        self.client.force_login(self.users[0])
+        url = reverse('polls:vote', args=(self.question.id,))
+        with django.test.override_settings(POLLS_VOTE_WRITE_BEHIND=True), \
+                mock.patch('polls.views.get_vote_queue',
+                           return_value=self.queue):
+            self.client.post(url, {"choice": self.choice2.id})
+        self.assertFalse(Vote.objects.exists())
+        self.queue.flush()
+        self.assertEqual(Vote.objects.get().choice, self.choice2)
+
+
+class TallyShardTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = Question.objects.create(question_text="Viral?",
+                                               tally_shards=4)
+        cls.yes = Choice.objects.create(question=cls.question,
+                                        choice_text="Yes")
+        cls.no = Choice.objects.create(question=cls.question,
+                                       choice_text="No")
+        cls.users = [User.objects.create_user(username=f"fan{n}")
+                     for n in range(6)]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_votes_are_counted_in_shards(self):
+        """Votes of a sharded question go to the voters' shards."""
+        for user in self.users:
+            Vote.objects.cast(user, self.yes)
+        self.yes.refresh_from_db()
+        self.assertEqual(self.yes.vote_count, 0)
+        self.assertEqual(
+            set(self.yes.choicetallyshard_set.values_list('shard', flat=True)),
+            {user.pk % 4 for user in self.users})
+        self.assertEqual(self.yes.votes, 6)
+        self.assertEqual(cached_results_by_id(self.question.pk)['total_votes'],
+                         6)
+        choice = Choice.objects.with_tally().get(pk=self.yes.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(choice.votes, 6)
+
+    def test_switching_vote(self):
+        """A switched vote moves between the shards of the two choices."""
+        Vote.objects.cast(self.users[0], self.yes)
+        Vote.objects.cast(self.users[0], self.no)
+        self.assertEqual((self.yes.votes, self.no.votes), (0, 1))
+
+    def test_compaction_keeps_the_totals(self):
+        """Compaction folds the shards into vote_count without a change."""
+        for user in self.users:
+            Vote.objects.cast(user, self.yes)
+        out = StringIO()
+        call_command('compact_vote_shards', stdout=out)
+        self.assertIn("1 choice(s)", out.getvalue())
+        self.yes.refresh_from_db()
+        self.assertEqual(self.yes.vote_count, 6)
+        self.assertFalse(ChoiceTallyShard.objects.exclude(votes=0).exists())
+        # a vote switched after compaction leaves a negative shard
+        Vote.objects.cast(self.users[0], self.no)
+        self.assertEqual((self.yes.votes, self.no.votes), (5, 1))
+        self.assertEqual(
+            [choice['votes'] for choice in
+             cached_results_by_id(self.question.pk)['choices']], [5, 1])
+
+    def test_recount_clears_the_shards(self):
+        """Rebuilding the tallies from the votes replaces the shards."""
+        for user in self.users[:3]:
+            Vote.objects.cast(user, self.no)
+        call_command('rebuild_vote_counts', stdout=StringIO())
+        self.no.refresh_from_db()
+        self.assertEqual(self.no.vote_count, 3)
+        self.assertFalse(ChoiceTallyShard.objects.exists())
+        self.assertEqual(self.no.votes, 3)
+
+    def test_deleted_vote_is_discounted(self):
+        """Deleting a vote counted in a shard removes it from the tally."""
+        Vote.objects.cast(self.users[0], self.yes)
+        Vote.objects.cast(self.users[1], self.yes)
+        Vote.objects.get(user=self.users[0]).delete()
+        self.assertEqual(self.yes.votes, 1)
+        # deleting a queryset recounts the tally into vote_count
+        Vote.objects.filter(user=self.users[1]).delete()
+        self.yes.refresh_from_db()
+        self.assertEqual(self.yes.votes, 0)
+
+    def test_switch_after_sharding_is_turned_off(self):
+        """A vote counted in a shard can switch once the shards are off."""
+        Vote.objects.cast(self.users[0], self.yes)
+        Question.objects.filter(pk=self.question.pk).update(tally_shards=None)
+        self.client.force_login(self.users[0])
+        response = self.client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            {"choice": self.no.id})
+        self.assertEqual(response.status_code, 302)
+        self.yes.refresh_from_db()
+        self.no.refresh_from_db()
+        self.assertEqual((self.yes.votes, self.no.votes), (0, 1))
+
+    def test_question_row_is_left_alone(self):
+        """
+        Voting does not write the question row of a sharded question, so
+        the results page validators follow the totals instead.
+        """
+        self.client.force_login(self.users[0])
+        url = reverse('polls:results', args=(self.question.id,))
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        updated_at = Question.objects.get(pk=self.question.pk).updated_at
+        Vote.objects.cast(self.users[1], self.no)
+        self.assertEqual(Question.objects.get(pk=self.question.pk).updated_at,
+                         updated_at)
+        response = self.client.get(url, headers={
+            'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "1 vote")
+        response = self.client.get(url, headers={
+            'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+
+class TallyShardConcurrencyTests(django.test.TransactionTestCase):
+
+    def storm(self, tally_shards, threads, voters=48):
+        """Return the throughput of `voters` voting for one choice."""
+        question = Question.objects.create(question_text="Storm?",
+                                           tally_shards=tally_shards)
+        choice = Choice.objects.create(question=question, choice_text="Yes")
+        users = User.objects.bulk_create(
+            [User(username=f"storm{question.pk}x{n}", password='!')
+             for n in range(voters)])
+        stats = vote_storm(choice, users, threads=threads)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, voters)
+        self.assertEqual(Vote.objects.filter(choice=choice).count(), voters)
+        return stats
+
+    def test_many_threads_vote_for_one_choice(self):
+        """
+        Concurrent votes for one choice are all counted exactly, with or
+        without shards. SQLite writes one transaction at a time, so the
+        throughput can only grow with the threads on other databases.
+        """
+        self.storm(tally_shards=None, threads=8)
+        sharded = self.storm(tally_shards=8, threads=8)
+        serial = self.storm(tally_shards=8, threads=1)
+        self.assertEqual(serial['retries'], 0)
+        if connection.vendor != 'sqlite':
+            self.assertGreater(sharded['votes_per_second'],
+                               serial['votes_per_second'])
+
+
+class VoteRollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = create_question(question_text="Trend?", days=-1)
+        cls.yes = Choice.objects.create(question=cls.question,
+                                        choice_text="Yes")
+        cls.no = Choice.objects.create(question=cls.question,
+                                       choice_text="No")
+        cls.users = [User.objects.create_user(username=f"trender{n}")
+                     for n in range(4)]
+        cls.start = timezone.now().replace(
+            minute=5, second=0, microsecond=0) - datetime.timedelta(days=1)
+
+    def vote(self, user, choice, minutes):
+        """Cast a vote `minutes` after the start of the test hour."""
+        vote = Vote.objects.cast(user, choice)
+        vote.created_at = self.start + datetime.timedelta(minutes=minutes,
+                                                          seconds=30)
+        Vote.objects.filter(pk=vote.pk).update(created_at=vote.created_at)
+        return vote
+
+    def buckets(self, period):
+        """Return the (choice, start minute offset, votes) of a period."""
+        return sorted(
+            (choice_id, int((start - self.start).total_seconds() // 60),
+             votes)
+            for choice_id, start, votes in VoteRollup.objects.filter(
+                period=period).values_list('choice_id', 'start', 'votes'))
+
+    def test_aggregate_new_votes_only(self):
+        """Each run only counts the votes changed since the last one."""
+        self.vote(self.users[0], self.yes, 0)
+        self.vote(self.users[1], self.yes, 0)
+        self.vote(self.users[2], self.no, 1)
+        self.assertEqual(aggregate_votes(lag=0)['votes'], 3)
+        self.vote(self.users[3], self.yes, 70)
+        self.assertEqual(aggregate_votes(lag=0)['votes'], 1)
+        self.assertEqual(aggregate_votes(lag=0)['votes'], 0)
+        yes, no = self.yes.id, self.no.id
+        self.assertEqual(self.buckets(VoteRollup.MINUTE),
+                         sorted([(yes, 0, 2), (no, 1, 1), (yes, 70, 1)]))
+        self.assertEqual(self.buckets(VoteRollup.HOUR),
+                         sorted([(yes, -5, 2), (no, -5, 1), (yes, 55, 1)]))
+
+    def test_lag(self):
+        """Votes changed within the lag are left to a later run."""
+        self.vote(self.users[0], self.yes, 0)
+        self.assertEqual(aggregate_votes(lag=60)['votes'], 0)
+        self.assertEqual(aggregate_votes(lag=0)['votes'], 1)
+
+    def test_switched_vote(self):
+        """A changed vote moves to its new choice in the same minute."""
+        vote = self.vote(self.users[0], self.yes, 0)
+        aggregate_votes(lag=0)
+        Vote.objects.cast(self.users[0], self.no)
+        self.assertEqual(aggregate_votes(lag=0)['votes'], 1)
+        self.assertEqual(Vote.objects.get(pk=vote.pk).created_at,
+                         vote.created_at)
+        self.assertEqual(self.buckets(VoteRollup.MINUTE),
+                         [(self.no.id, 0, 1)])
+
+    def test_deleted_vote(self):
+        """Deleting an aggregated vote removes it from its buckets."""
+        vote = self.vote(self.users[0], self.yes, 0)
+        self.vote(self.users[1], self.yes, 0)
+        aggregate_votes(lag=0)
+        vote.delete()
+        self.assertEqual(self.buckets(VoteRollup.MINUTE),
+                         [(self.yes.id, 0, 1)])
+        self.assertEqual(self.buckets(VoteRollup.HOUR),
+                         [(self.yes.id, -5, 1)])
+
+    def test_votes_without_timestamp(self):
+        """Votes cast before votes were timestamped are not charted."""
+        Vote.objects.create(user=self.users[0], question=self.question,
+                            choice=self.yes, created_at=None)
+        self.assertEqual(aggregate_votes(lag=0)['votes'], 0)
+
+    def test_many_scattered_buckets(self):
+        """Over a thousand separate minutes are recounted in batches."""
+        users = User.objects.bulk_create(
+            [User(username=f"scattered{n}", password='!')
+             for n in range(1500)])
+        Vote.objects.bulk_create([
+            Vote(user=user, question=self.question, choice=self.yes,
+                 created_at=self.start + datetime.timedelta(minutes=2 * n))
+            for n, user in enumerate(users)])
+        self.assertEqual(rebuild_rollups(lag=0)['buckets'], 1500)
+        self.assertEqual(
+            VoteRollup.objects.filter(period=VoteRollup.MINUTE).count(), 1500)
+        self.assertEqual(
+            sum(VoteRollup.objects.filter(
+                period=VoteRollup.HOUR).values_list('votes', flat=True)),
+            1500)
+
+    def test_rebuild_command(self):
+        """The command can drop and recount every rollup."""
+        self.vote(self.users[0], self.yes, 0)
+        aggregate_votes(lag=0)
+        VoteRollup.objects.update(votes=9)
+        out = StringIO()
+        call_command('aggregate_votes', rebuild=True, lag=0, stdout=out)
+        self.assertIn("Aggregated 1 vote(s)", out.getvalue())
+        self.assertEqual(self.buckets(VoteRollup.MINUTE),
+                         [(self.yes.id, 0, 1)])
+
+    def test_trend_endpoint(self):
+        """The trend of recent minutes and hours is read from rollups."""
+        for user in self.users[:3]:
+            Vote.objects.cast(user, self.yes)
+        aggregate_votes(lag=0)
+        url = reverse('polls:results_trend', args=(self.question.id,))
+        for period, points in (('minute', 60), ('hour', 48)):
+            with self.subTest(period=period):
+                data = self.client.get(url, {'period': period}).json()
+                self.assertEqual(len(data['buckets']), points)
+                self.assertEqual([choice['choice_text']
+                                  for choice in data['choices']],
+                                 ["Yes", "No"])
+                self.assertEqual(data['buckets'][-1]['votes'], [3, 0])
+
+    def test_trend_not_found(self):
+        """Unknown periods and unpublished questions give 404."""
+        future = create_question(question_text="Later?", days=1)
+        for pk, params in ((self.question.id, {'period': 'day'}),
+                           (future.id, {})):
+            with self.subTest(pk=pk, params=params):
+                response = self.client.get(
+                    reverse('polls:results_trend', args=(pk,)), params)
+                self.assertEqual(response.status_code, 404)
+
+
+class DatabaseProfileTests(TestCase):
+
+    def test_sqlite_replica_file_is_tuned(self):
+        """A second SQLite file built from a URL gets the tuned pragmas."""
+        with tempfile.TemporaryDirectory() as directory:
+            replica = database_config('sqlite:///replica.sqlite3',
+                                      base_dir=Path(directory))
+            self.assertEqual(replica['NAME'],
+                             Path(directory) / 'replica.sqlite3')
+            # a separate handler, its only alias must be called default
+            handler = ConnectionHandler({'default': replica})
+            try:
+                with handler['default'].cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0],
+                                     settings.SQLITE_PRAGMAS['busy_timeout'])
+            finally:
+                handler.close_all()
+
+    def test_postgres_url(self):
+        """A PostgreSQL URL is split into connection settings."""
+        config = database_config('postgres://polls:s%40fe@db:5432/polls',
+                                 conn_max_age=60)
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(
+            (config['NAME'], config['USER'], config['PASSWORD'],
+             config['HOST'], config['PORT'], config['CONN_MAX_AGE']),
+            ('polls', 'polls', 's@fe', 'db', '5432', 60),
+        )
+
+
+@django.test.override_settings(POLLS_REPLICA_DATABASES=['replica1', 'replica2'])
+class ReplicaRouterTests(django.test.SimpleTestCase):
+
+    def test_replica_router(self):
+        """Polls reads go to a replica, writes and auth go to the primary."""
+        router = ReplicaRouter()
+        self.assertIn(router.db_for_read(Question), ['replica1', 'replica2'])
+        self.assertIsNone(router.db_for_read(User))
+        self.assertEqual(router.db_for_write(Vote), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'polls'))
+
+    def test_round_robin(self):
+        """The default policy cycles through the replicas."""
+        router = ReplicaRouter()
+        self.assertEqual([router.db_for_read(Choice) for _ in range(4)],
+                         ['replica1', 'replica2', 'replica1', 'replica2'])
+
+    @django.test.override_settings(POLLS_REPLICA_POLICY='least-recent')
+    def test_least_recently_used(self):
+        """The least-recent policy picks the replica idle the longest."""
+        router = ReplicaRouter()
+        first = router.db_for_read(Question)
+        second = router.db_for_read(Question)
+        self.assertNotEqual(first, second)
+        self.assertEqual(router.db_for_read(Question), first)
+
+    def test_pinned_reads_use_primary(self):
+        """Reads inside use_primary() are not sent to a replica."""
+        router = ReplicaRouter()
+        with use_primary():
+            self.assertIsNone(router.db_for_read(Vote))
+
+    def test_transaction_reads_use_primary(self):
+        """Reads inside a transaction on the primary stay on it."""
+        router = ReplicaRouter()
+        with mock.patch.object(connections['default'], 'in_atomic_block',
+                               True):
+            self.assertIsNone(router.db_for_read(Vote))
+
+    def test_write_pins_client_to_primary(self):
+        """A write marks the client so its next reads use the primary."""
+        reads = []
+        middleware = ReplicaPinningMiddleware(
+            lambda request: reads.append(ReplicaRouter().db_for_read(Vote))
+            or HttpResponse())
+        factory = django.test.RequestFactory()
+        response = middleware(factory.post('/polls/1/vote/'))
+        cookie = settings.POLLS_REPLICA_PIN_COOKIE
+        self.assertIn(cookie, response.cookies)
+        middleware(factory.get('/polls/1/results/', HTTP_COOKIE=f'{cookie}=1'))
+        middleware(factory.get('/polls/1/results/'))
+        self.assertEqual(reads[:2], [None, None])
+        self.assertIn(reads[2], ['replica1', 'replica2'])
+
+
+class ReplicaReadTests(django.test.TransactionTestCase):
+    """
+    Pages read polls from a replica, here a second connection to the test
+    database, which is a shared in-memory SQLite database.
+    """
+    replica = 'replica_reads'
+
+    def setUp(self):
+        cache.clear()
+        connections.settings[self.replica] = dict(
+            connections['default'].settings_dict)
+        self.addCleanup(connections.settings.pop, self.replica)
+        self.addCleanup(connections.__delitem__, self.replica)
+        routing = django.test.override_settings(
+            DATABASE_ROUTERS=['polls.routers.ReplicaRouter'],
+            POLLS_REPLICA_DATABASES=[self.replica])
+        routing.enable()
+        self.addCleanup(routing.disable)
+        self.question = create_question(question_text="Replicated?", days=-1)
+        Choice.objects.create(question=self.question, choice_text="Yes")
+
+    def test_pages_read_from_the_replica(self):
+        """The index and results pages query polls on the replica."""
+        if connection.vendor != 'sqlite':
+            self.skipTest("the replica shares an in-memory SQLite database")
+        replica_connection = connections[self.replica]
+        for url in (reverse('polls:index'),
+                    reverse('polls:results', args=(self.question.id,))):
+            with self.subTest(url=url), \
+                    CaptureQueriesContext(connection) as primary, \
+                    CaptureQueriesContext(replica_connection) as replica:
+                response = self.client.get(url)
+                self.assertContains(response, "Replicated?")
+            self.assertTrue(any('polls_question' in query['sql']
+                                for query in replica))
+            self.assertFalse([query['sql'] for query in primary
+                              if 'polls_question' in query['sql']])
+
+    def test_results_cache_is_filled_from_the_primary(self):
+        """
+        Cached results are computed on the primary, so a lagging replica
+        cannot hand stale totals to voters who read their own writes.
+        """
+        if connection.vendor != 'sqlite':
+            self.skipTest("the replica shares an in-memory SQLite database")
+        url = reverse('polls:results', args=(self.question.id,))
+        replica_connection = connections[self.replica]
+        with CaptureQueriesContext(connection) as primary, \
+                CaptureQueriesContext(replica_connection) as replica:
+            self.client.get(url)
+        self.assertTrue(any('polls_choice' in query['sql']
+                            for query in primary))
+        self.assertFalse([query['sql'] for query in replica
+                          if 'polls_choice' in query['sql']])
+        with CaptureQueriesContext(connection) as primary:
+            self.client.get(url)
+        self.assertFalse([query['sql'] for query in primary
+                          if 'polls_' in query['sql']])
+
+
+class BenchmarkTests(TestCase):
+
+    def test_benchmark_reports_every_endpoint(self):
+        """The benchmark seeds data and reports each endpoint."""
+        seed(questions=3, choices=2, users=2, votes=4)
+        self.assertEqual(Vote.objects.count(), 4)
+        report = run_benchmark(requests=2)
+        self.assertEqual(set(report), {'polls:index', 'polls:detail',
+                                       'polls:results', 'polls:vote',
+                                       'signup'})
+        for stats in report.values():
+            self.assertEqual(stats['requests'], 2)
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+
+
+class AsyncViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = create_question(question_text="Async?", days=-1)
+        cls.choice = Choice.objects.create(question=cls.question,
+                                           choice_text="Yes")
+        cls.user = User.objects.create_user(username="async")
+
+    def setUp(self):
+        cache.clear()
+        request_metrics.reset()
+
+    async def test_async_index(self):
+        """The async index lists the published questions."""
+        response = await self.async_client.get(reverse('polls:async_index'))
+        self.assertContains(response, "Async?")
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    async def test_async_index_invalid_cursor(self):
+        """A malformed cursor gives 404 as in the sync index."""
+        response = await self.async_client.get(reverse('polls:async_index'),
+                                               {'before': 'nonsense'})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_results(self):
+        """The async results page shows the totals and supports 304."""
+        url = reverse('polls:async_results', args=(self.question.id,))
+        response = await self.async_client.get(url)
+        self.assertContains(response, "0 votes")
+        again = await self.async_client.get(
+            url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+    async def test_async_results_missing_question(self):
+        """The async results of an unknown question give 404."""
+        response = await self.async_client.get(
+            reverse('polls:async_results', args=(self.question.id + 1,)))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_vote_requires_login(self):
+        """Anonymous voters are sent to the login page."""
+        response = await self.async_client.post(
+            reverse('polls:async_vote', args=(self.question.id,)),
+            {'choice': self.choice.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response.url)
+
+    async def test_async_vote(self):
+        """The async vote records the vote and confirms it."""
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post(
+            reverse('polls:async_vote', args=(self.question.id,)),
+            {'choice': self.choice.id})
+        self.assertRedirects(
+            response,
+            reverse('polls:async_results', args=(self.question.id,)),
+            fetch_redirect_response=False)
+        self.assertTrue(await Vote.objects.filter(
+            user=self.user, choice=self.choice).aexists())
+        page = await self.async_client.get(response.url)
+        self.assertContains(page, "has been saved")
+        self.assertContains(page, "1 vote")
+
+    async def test_async_vote_without_choice(self):
+        """Voting without a choice goes back to the question."""
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post(
+            reverse('polls:async_vote', args=(self.question.id,)))
+        self.assertRedirects(
+            response, reverse('polls:detail', args=(self.question.id,)),
+            fetch_redirect_response=False)
+
+
+class LoadTestTests(django.test.LiveServerTestCase):
+
+    def test_loadtest_reports_every_endpoint(self):
+        """The load test drives a running server over many connections."""
+        question = create_question(question_text="Loaded.", days=-1)
+        report = run_loadtest(self.live_server_url, endpoints(question.id),
+                              concurrency=4, requests=8)
+        self.assertEqual(set(report), {'polls:index', 'polls:async_index',
+                                       'polls:results',
+                                       'polls:async_results'})
+        for stats in report.values():
+            self.assertEqual(stats['errors'], 0)
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        request_metrics.reset()
+
+    def test_server_timing_header(self):
+        """Responses carry the SQL, template and total time."""
+        response = self.client.get(reverse('polls:index'))
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_timings_are_aggregated_per_view(self):
+        """Each request is added to the totals of its URL name."""
+        self.client.get(reverse('polls:index'))
+        self.client.get(reverse('polls:index'))
+        totals = request_metrics.snapshot()['polls:index']
+        self.assertEqual(totals['requests'], 2)
+        self.assertGreater(totals['template_ms'], 0)
+
+    @django.test.override_settings(POLLS_REQUEST_BUDGET_MS=0)
+    def test_slow_request_is_logged(self):
+        """A request over the budget is logged with its slowest queries."""
+        create_question(question_text="Slow.", days=-1)
+        with self.assertLogs('polls.middleware', level='WARNING') as logs:
+            self.client.get(reverse('polls:index'))
+        self.assertIn('polls:index', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_metrics_endpoint_is_staff_only(self):
+        """Only staff can read the aggregated timings."""
+        url = reverse('polls:metrics')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        staff = User.objects.create_user(username="staff", is_staff=True)
+        self.client.force_login(staff)
+        self.client.get(reverse('polls:index'))
+        data = self.client.get(url).json()
+        self.assertEqual(data['views']['polls:index']['requests'], 1)
+        self.assertIn('depth', data['vote_queue'])
+
+
+class SessionStorageTests(TestCase):
+
+    def test_cleanup_sessions_in_batches(self):
+        """Expired sessions are deleted in batches, live ones are kept."""
+        past = timezone.now() - datetime.timedelta(days=1)
+        future = timezone.now() + datetime.timedelta(days=1)
+        Session.objects.bulk_create(
+            [Session(session_key=f"expired{n}", session_data="",
+                     expire_date=past) for n in range(5)]
+            + [Session(session_key="live", session_data="",
+                       expire_date=future)]
+        )
+        out = StringIO()
+        call_command('cleanup_sessions', batch_size=2, stdout=out)
+        self.assertIn("Deleted 5", out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('pk', flat=True)),
+                         ["live"])
+
+    def test_session_cache_is_shared_by_workers(self):
+        """By default sessions are cached where every worker sees them."""
+        self.assertNotIn('locmem', settings.CACHES['sessions']['BACKEND'])
+
+    def test_session_cache_rarely_lists_its_files(self):
+        """The session file cache lists its directory on few writes."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sessions = SessionFileCache(directory.name,
+                                    {'OPTIONS': {'MAX_ENTRIES': 10}})
+        with mock.patch.object(sessions, '_list_cache_files',
+                               wraps=sessions._list_cache_files) as listing:
+            for n in range(2 * SessionFileCache.cull_every):
+                sessions.set(f"session{n}", n)
+        self.assertEqual(listing.call_count, 2)
+        self.assertLess(len(sessions._list_cache_files()),
+                        2 * SessionFileCache.cull_every)
+
+    def test_messages_use_a_cookie(self):
+        """Messages are kept in a cookie instead of the session."""
+        response = self.client.get(reverse('polls:detail', args=(999,)))
+        self.assertIn('messages', response.cookies)
+        self.assertFalse(Session.objects.exists())
+
+
+class StaticPipelineTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        (self.root / 'polls').mkdir()
+        self.css = b'body { color: white; }\n' * 100
+        (self.root / 'polls' / 'style.0123456789ab.css').write_bytes(self.css)
+        (self.root / 'polls' / 'style.0123456789ab.css.gz').write_bytes(
+            gzip.compress(self.css))
+        self.url = '/static/polls/style.0123456789ab.css'
+        static_root = django.test.override_settings(STATIC_ROOT=self.root)
+        static_root.enable()
+        self.addCleanup(static_root.disable)
+
+    def get(self, path, **headers):
+        """Request a static file through the serving view."""
+        request = django.test.RequestFactory().get(path, **headers)
+        return staticserve.serve(request, path.removeprefix('/static/'))
+
+    def test_collectstatic_writes_compressed_variants(self):
+        """Post-processing fingerprints files and writes gzip variants."""
+        source = self.root / 'source'
+        source.mkdir()
+        (source / 'site.css').write_bytes(self.css)
+        storage = CompressedManifestStaticFilesStorage(
+            location=self.root / 'collected')
+        storage.save('site.css', ContentFile(self.css))
+        list(storage.post_process(
+            {'site.css': (FileSystemStorage(location=source), 'site.css')}))
+        hashed = storage.stored_name('site.css')
+        self.assertNotEqual(hashed, 'site.css')
+        compressed = self.root / 'collected' / (hashed + '.gz')
+        self.assertEqual(gzip.decompress(compressed.read_bytes()), self.css)
+
+    def test_hashed_file_is_immutable_and_compressed(self):
+        """A fingerprinted file is cached forever and sent gzipped."""
+        response = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_conditional_request(self):
+        """A matching ETag returns 304 without a body."""
+        etag = self.get(self.url)['ETag']
+        response = self.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_request(self):
+        """A byte range returns 206 with only the requested bytes."""
+        response = self.get(self.url, HTTP_RANGE='bytes=5-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'],
+                         f'bytes 5-9/{len(self.css)}')
+        self.assertEqual(b''.join(response.streaming_content), self.css[5:10])
+        response = self.get(self.url, HTTP_RANGE=f'bytes={len(self.css)}-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_asgi_streams_the_file(self):
+        """Under ASGI files and ranges are streamed asynchronously."""
+        async def content(response):
+            return b''.join([chunk async for chunk in
+                             response.streaming_content])
+
+        factory = django.test.AsyncRequestFactory()
+        path = self.url.removeprefix('/static/')
+        for headers, expected in (({}, self.css),
+                                  ({'Range': 'bytes=5-9'}, self.css[5:10])):
+            with self.subTest(headers=headers):
+                response = staticserve.serve(
+                    factory.get(self.url, headers=headers), path)
+                self.assertTrue(response.is_async)
+                self.assertEqual(asyncio.run(content(response)), expected)
+
+    def test_missing_file(self):
+        """Files outside STATIC_ROOT or missing return 404."""
+        with self.assertRaises(Http404):
+            self.get('/static/../settings.py')
+        with self.assertRaises(Http404):
+            self.get('/static/polls/missing.css')
@@ -0,0 +1,270 @@
+"""
+Streaming import and export of polls as JSON Lines or CSV.
+
+A poll file holds one record per line: the questions, then their choices,
+then the votes. Records refer to questions and choices by their id in the
+file and to users by username, so a file can be loaded into a database
+that already has polls. Both directions stream, holding one batch of rows
+and the id maps of the questions and choices in memory, never the votes.
+"""
+import csv
+import gzip
+import json
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+
+from .fragments import expire_question_list
+from .models import Choice, Question, Vote
+
+FORMATS = ('jsonl', 'csv')
+FIELDS = ['model', 'id', 'question', 'choice', 'user', 'question_text',
+          'choice_text', 'pub_date', 'end_date', 'created_at']
+
+
+class PollFileError(ValueError):
+    """A poll file that cannot be imported."""
+
+
+def guess_format(path):
+    """Return the format of a poll file from its name."""
+    if path.removesuffix('.gz').endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+
+def open_poll_file(path, mode):
+    """Open a poll file as text, compressed if its name ends with .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def export_records(question_ids=None, chunk_size=2000):
+    """
+    Yield the records of every question, or those in `question_ids`,
+    followed by their choices and votes, reading `chunk_size` rows at a
+    time.
+    """
+    questions = Question.objects.order_by('pk')
+    choices = Choice.objects.order_by('pk')
+    votes = Vote.objects.order_by('pk')
+    if question_ids:
+        questions = questions.filter(pk__in=question_ids)
+        choices = choices.filter(question_id__in=question_ids)
+        votes = votes.filter(question_id__in=question_ids)
+
+    for pk, text, pub_date, end_date in questions.values_list(
+            'pk', 'question_text', 'pub_date', 'end_date').iterator(
+            chunk_size=chunk_size):
+        yield {
+            'model': 'question',
+            'id': pk,
+            'question_text': text,
+            'pub_date': pub_date.isoformat(),
+            'end_date': end_date.isoformat() if end_date else None,
+        }
+    for pk, question_id, text in choices.values_list(
+            'pk', 'question_id', 'choice_text').iterator(
+            chunk_size=chunk_size):
+        yield {'model': 'choice', 'id': pk, 'question': question_id,
+               'choice_text': text}
+    for question_id, choice_id, username, created_at in votes.values_list(
+            'question_id', 'choice_id', 'user__username',
+            'created_at').iterator(chunk_size=chunk_size):
+        yield {'model': 'vote', 'question': question_id, 'choice': choice_id,
+               'user': username,
+               'created_at': created_at.isoformat() if created_at else None}
+
+
+def write_records(records, stream, format='jsonl'):
+    """Write `records` to a text stream and return how many there were."""
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(stream, FIELDS)
+        writer.writeheader()
+        for count, record in enumerate(records, 1):
+            writer.writerow(record)
+    else:
+        for count, record in enumerate(records, 1):
+            stream.write(json.dumps(record) + '\n')
+    return count
+
+
+def read_records(stream, format='jsonl'):
+    """Yield the records of a text stream one line at a time."""
+    if format == 'csv':
+        for record in csv.DictReader(stream):
+            # CSV has no null, every column of the other models is empty
+            yield {key: value if value != '' else None
+                   for key, value in record.items()}
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+class PollImporter:
+    """
+    Collect poll records into batches and bulk insert them, questions
+    before choices before votes, so every foreign key of a batch can be
+    resolved through the ids of the rows already inserted.
+    """
+
+    def __init__(self, batch_size=5000, create_users=False):
+        self.batch_size = batch_size
+        self.create_users = create_users
+        self.question_ids = {}
+        self.choice_ids = {}
+        self.choice_questions = {}
+        self.user_ids = {}
+        self.pending = {'question': [], 'choice': [], 'vote': []}
+        self.counts = {'question': 0, 'choice': 0, 'vote': 0, 'user': 0}
+
+    def add(self, record, line):
+        """Queue `record`, record number `line` of the file."""
+        model = record.get('model')
+        if model not in self.pending:
+            raise PollFileError(f"Record {line}: unknown model {model!r}.")
+        self.pending[model].append((line, record))
+        if len(self.pending[model]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Insert every queued record."""
+        self._insert_questions(self.pending['question'])
+        self._insert_choices(self.pending['choice'])
+        self._insert_votes(self.pending['vote'])
+        for batch in self.pending.values():
+            batch.clear()
+
+    def _insert_questions(self, batch):
+        questions = [
+            Question(question_text=record['question_text'],
+                     pub_date=self._datetime(record['pub_date'], line),
+                     end_date=self._datetime(record.get('end_date'), line))
+            for line, record in batch
+        ]
+        Question.objects.bulk_create(questions)
+        for (line, record), question in zip(batch, questions):
+            self.question_ids[int(record['id'])] = question.pk
+        self.counts['question'] += len(questions)
+
+    def _insert_choices(self, batch):
+        choices = [
+            Choice(question_id=self._resolve(self.question_ids,
+                                             record['question'], line),
+                   choice_text=record['choice_text'])
+            for line, record in batch
+        ]
+        Choice.objects.bulk_create(choices)
+        for (line, record), choice in zip(batch, choices):
+            self.choice_ids[int(record['id'])] = choice.pk
+            self.choice_questions[choice.pk] = choice.question_id
+        self.counts['choice'] += len(choices)
+
+    def _insert_votes(self, batch):
+        if not batch:
+            return
+        self._load_users({record['user'] for _, record in batch})
+        # the last vote of a user in a question wins, as when voting
+        latest = {}
+        for line, record in batch:
+            user_id = self._resolve(self.user_ids, record['user'], line)
+            question_id = self._resolve(self.question_ids,
+                                        record['question'], line)
+            choice_id = self._resolve(self.choice_ids, record['choice'], line)
+            if self.choice_questions[choice_id] != question_id:
+                raise PollFileError(
+                    f"Record {line}: choice {record['choice']!r} is not a "
+                    f"choice of question {record['question']!r}.")
+            latest[user_id, question_id] = (
+                choice_id, self._datetime(record.get('created_at'), line))
+        adapt = connection.ops.adapt_datetimefield_value
+        # imported votes count as changed now, so the next aggregation of
+        # the vote rollups counts them in the buckets they were cast in
+        now = adapt(timezone.now())
+        with connection.cursor() as cursor:
+            # in index order, the inserts touch far fewer index pages
+            cursor.executemany(self.vote_upsert, sorted(
+                (user_id, question_id, choice_id, adapt(created_at), now)
+                for (user_id, question_id), (choice_id, created_at)
+                in latest.items()
+            ))
+        self.counts['vote'] += len(batch)
+
+    @cached_property
+    def vote_upsert(self):
+        """
+        Return the SQL inserting one vote or replacing the choice of the
+        user's vote in its question, keeping when it was first cast.
+        Building a million Vote instances for bulk_create costs far more
+        than writing them, so votes are inserted with executemany instead.
+        """
+        ops = connection.ops
+        columns = ['user_id', 'question_id', 'choice_id', 'created_at',
+                   'updated_at']
+        return 'INSERT INTO {} ({}) VALUES (%s, %s, %s, %s, %s) {}'.format(
+            ops.quote_name(Vote._meta.db_table),
+            ', '.join(map(ops.quote_name, columns)),
+            ops.on_conflict_suffix_sql(
+                [Vote._meta.get_field(column.removesuffix('_id'))
+                 for column in columns],
+                OnConflict.UPDATE, ['choice_id', 'updated_at'],
+                ['user_id', 'question_id']),
+        )
+
+    def _load_users(self, usernames):
+        """Add the ids of `usernames` to the user map."""
+        missing = usernames - self.user_ids.keys()
+        self.user_ids.update(User.objects.filter(
+            username__in=missing).values_list('username', 'pk'))
+        missing -= self.user_ids.keys()
+        if missing and self.create_users:
+            # the new users cannot log in until they reset their password
+            users = User.objects.bulk_create(
+                [User(username=username, password='!')
+                 for username in sorted(missing)])
+            self.user_ids.update((user.username, user.pk) for user in users)
+            self.counts['user'] += len(users)
+
+    def _resolve(self, ids, key, line):
+        """Return the id that `key` of the file maps to."""
+        try:
+            return ids[key if ids is self.user_ids else int(key)]
+        except (KeyError, TypeError, ValueError):
+            raise PollFileError(f"Record {line}: unknown reference {key!r}.")
+
+    def _datetime(self, value, line):
+        """Return the datetime of an ISO 8601 value of the file."""
+        if not value:
+            return None
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise PollFileError(f"Record {line}: invalid date {value!r}.")
+        return parsed
+
+
+def import_records(records, batch_size=5000, create_users=False):
+    """
+    Insert poll `records` in one transaction and recount the votes of the
+    new choices. Return the number of rows imported per model.
+    """
+    importer = PollImporter(batch_size=batch_size, create_users=create_users)
+    with transaction.atomic():
+        for line, record in enumerate(records, 1):
+            importer.add(record, line)
+        importer.flush()
+        choice_ids = list(importer.choice_ids.values())
+        for start in range(0, len(choice_ids), batch_size):
+            Choice.objects.filter(
+                pk__in=choice_ids[start:start + batch_size]).recount_votes()
+    expire_question_list()
+    return importer.counts
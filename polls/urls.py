@@ -7,5 +7,17 @@ urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
     path('<int:pk>/', views.DetailView.as_view(), name='detail'),
     path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    path('<int:pk>/results/json/', views.results_json, name='results_json'),
+    path('<int:pk>/results/trend/', views.results_trend,
+         name='results_trend'),
+    path('<int:pk>/results/stream/', views.results_stream,
+         name='results_stream'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
+    path('results/export/', views.export_results, name='export_results'),
+    path('metrics/', views.metrics, name='metrics'),
+    # async versions of the busiest views, to compare under ASGI
+    path('async/', views.AsyncIndexView.as_view(), name='async_index'),
+    path('async/<int:pk>/results/', views.AsyncResultsView.as_view(),
+         name='async_results'),
+    path('async/<int:question_id>/vote/', views.avote, name='async_vote'),
 ]
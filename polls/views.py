@@ -1,16 +1,53 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import login
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.forms import UserCreationForm
-from django.http import HttpResponseRedirect, Http404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (HttpResponse, HttpResponseRedirect, Http404,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, render, redirect
+from django.template.response import TemplateResponse
 from django.urls import reverse
 from django.views import generic
-from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.contrib import messages
+from django.db.models import OuterRef, Prefetch, Subquery
 
+from .conditional import (aresults_question, async_condition, index_etag,
+                          index_last_modified, json_results, results_etag,
+                          results_json_etag, results_last_modified,
+                          results_question)
+from .fragments import question_list_version
+from .ingest import get_vote_queue
+from .instrumentation import request_metrics
+from .live import get_results_broker, results_events, sse_event
 from .models import Choice, Question, Vote
+from .pagination import apage_before, page_before
+from .reports import FORMATS as EXPORT_FORMATS, export_response
+from .rollups import PERIODS as TREND_PERIODS, vote_trend
+from .results import (acached_question_results, cached_question_results,
+                      cached_results_by_id)
+from .search import search_questions
+
+
+def status_key(questions):
+    """
+    Return the statuses of `questions` for the key of the cached question
+    list, since polls open and close as time passes without any write
+    that would expire it.
+    """
+    return ''.join(question.status[0] for question in questions)
 
 
+@method_decorator(condition(etag_func=index_etag,
+                            last_modified_func=index_last_modified),
+                  name='dispatch')
 class IndexView(generic.ListView):
     """
     View for displaying a list of the published questions.
@@ -20,12 +57,35 @@ class IndexView(generic.ListView):
 
     def get_queryset(self):
         """
-        Return the last five published questions (not including those set to be
-        published in the future).
+        Return one page of the latest published questions (not including
+        those set to be published in the future), starting after the
+        cursor given in the `before` query parameter, or the best matches
+        of the search in the `q` query parameter.
         """
-        return Question.objects.filter(
-            pub_date__lte=timezone.now()
-        ).order_by('-pub_date')
+        # pages only keep the questions published by now themselves
+        questions = Question.objects.with_status()
+        self.search_query = self.request.GET.get('q', '').strip()
+        if self.search_query:
+            self.next_cursor = None
+            return list(search_questions(questions.published(),
+                                         self.search_query)[
+                :settings.POLLS_SEARCH_RESULTS])
+        try:
+            page, self.next_cursor = page_before(
+                questions, self.request.GET.get('before'),
+                settings.POLLS_INDEX_PAGE_SIZE)
+        except ValueError:
+            raise Http404("Invalid page cursor.")
+        return page
+
+    def get_context_data(self, **kwargs):
+        """Add the cursor of the next page of questions and the search."""
+        context = super().get_context_data(**kwargs)
+        context['next_cursor'] = self.next_cursor
+        context['search_query'] = self.search_query
+        context['question_list_version'] = question_list_version()
+        context['status_key'] = status_key(context['latest_question_list'])
+        return context
 
 
 class DetailView(generic.DetailView):
@@ -38,43 +98,125 @@ class DetailView(generic.DetailView):
 
     def get_queryset(self):
         """
-        Excludes any questions that aren't published yet.
+        Excludes any questions that aren't published yet, annotates their
+        status, prefetches the choices and, for a logged in user,
+        annotates the choice of their previous vote.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        queryset = Question.objects.published().with_status(
+        ).prefetch_related(
+            Prefetch('choice_set', queryset=Choice.objects.order_by('pk'))
+        )
+        if self.request.user.is_authenticated:
+            previous_vote = Vote.objects.filter(user=self.request.user,
+                                                question=OuterRef('pk'))
+            queryset = queryset.annotate(previous_choice_id=Subquery(
+                previous_vote.values('choice_id')[:1]
+            ))
+        return queryset
 
     def get(self, request, *args, **kwargs):
         """
         Receive the request from the user and catch
         the direct-access attempt to the unpublished polls.
         """
-
         try:
-            question = get_object_or_404(Question, pk=kwargs["pk"])
+            self.object = self.get_object()
         except Http404:
             messages.error(request, f"Poll {kwargs['pk']} is not available.")
             return redirect('polls:index')
 
-        try:
-            vote = Vote.objects.get(user=request.user,
-                                    choice__in=question.choice_set.all())
-            previously_selected = vote.choice
-        except (Vote.DoesNotExist, TypeError):
-            previously_selected = None
-
-        if not question.can_vote():
+        if self.object.status != 'open':
             messages.error(request, "This poll is currently closed.")
             return redirect('polls:index')
 
-        return render(request, self.template_name, {"question": question,
-                                                    "previously_selected":
-                                                        previously_selected})
+        return self.render_to_response(
+            self.get_context_data(object=self.object)
+        )
 
+    def get_context_data(self, **kwargs):
+        """Add the choice of the user's previous vote, if any."""
+        context = super().get_context_data(**kwargs)
+        previous_choice_id = getattr(self.object, 'previous_choice_id', None)
+        context['previously_selected'] = next(
+            (choice for choice in self.object.choice_set.all()
+             if choice.pk == previous_choice_id),
+            None,
+        )
+        return context
 
+
+@method_decorator(condition(etag_func=results_etag,
+                            last_modified_func=results_last_modified),
+                  name='dispatch')
 class ResultsView(generic.DetailView):
     """View for display result of the poll"""
     model = Question
     template_name = 'polls/results.html'
 
+    def get_object(self, queryset=None):
+        """Reuse the question loaded for the conditional GET check."""
+        question = results_question(self.request, self.kwargs['pk'])
+        if question is None:
+            raise Http404("No question found matching the query.")
+        return question
+
+    def get_context_data(self, **kwargs):
+        """Add the aggregated vote totals of the question."""
+        context = super().get_context_data(**kwargs)
+        context['results'] = cached_question_results(self.object)
+        return context
+
+
+@condition(etag_func=results_json_etag)
+def results_json(request, pk):
+    """Return the aggregated results of a poll as JSON."""
+    results = json_results(request, pk)
+    if results is None:
+        raise Http404("No question found matching the query.")
+    return JsonResponse(results)
+
+
+def results_trend(request, pk):
+    """
+    Return the votes per choice of a poll in each of its recent minutes,
+    or hours with ?period=hour, as JSON read from the vote rollups.
+    """
+    period = request.GET.get('period', 'minute')
+    if period not in TREND_PERIODS:
+        raise Http404("Unknown trend period.")
+    question = get_object_or_404(Question.objects.published(), pk=pk)
+    return JsonResponse(vote_trend(question, period))
+
+
+async def results_stream(request, pk):
+    """
+    Stream the vote counts of a poll as Server-Sent Events.
+
+    Under ASGI the stream stays open and pushes the vote deltas as they
+    happen. A WSGI server would need a thread per open stream, so there
+    the current results are sent once and the browser polls again.
+    """
+    results = await sync_to_async(cached_results_by_id)(pk)
+    if results is None:
+        raise Http404("No question found matching the query.")
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            results_events(get_results_broker(), pk,
+                           keepalive=settings.POLLS_STREAM_KEEPALIVE,
+                           max_age=settings.POLLS_STREAM_MAX_AGE),
+            content_type='text/event-stream',
+        )
+    else:
+        retry_ms = int(settings.POLLS_STREAM_KEEPALIVE * 1000)
+        response = HttpResponse(
+            f'retry: {retry_ms}\n' + sse_event('results', results),
+            content_type='text/event-stream',
+        )
+    response['Cache-Control'] = 'no-cache'
+    # keep proxies such as nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 
 @login_required
 def vote(request, question_id):
@@ -93,42 +235,173 @@ def vote(request, question_id):
         messages.error(request, "Please select choice before submit the vote.")
         return redirect("polls:detail", pk=question_id)
 
-    this_user = request.user
+    if settings.POLLS_VOTE_WRITE_BEHIND and get_vote_queue().submit(
+            request.user.pk, question.pk, selected_choice.pk):
+        messages.success(request, f"Your vote for '{selected_choice}' "
+                                  f"has been received.")
+    else:
+        # create or switch the vote of this user and update the tallies
+        vote = Vote.objects.cast(request.user, selected_choice)
+        messages.success(request,
+                         f"Your vote for '{vote.choice}' has been saved.")
+
+    return HttpResponseRedirect(
+        reverse('polls:results', args=(question_id,))
+    )
+
+
+def async_login_required(view):
+    """login_required for async views, which Django 4.2 does not support."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # the first access to request.user reads the session and the user
+        if await sync_to_async(lambda: request.user.is_authenticated)():
+            return await view(request, *args, **kwargs)
+        return redirect_to_login(request.get_full_path())
+    return wrapper
 
+
+@method_decorator(async_condition(etag_func=index_etag,
+                                  last_modified_func=index_last_modified),
+                  name='dispatch')
+class AsyncIndexView(generic.base.TemplateResponseMixin, generic.View):
+    """Async version of IndexView."""
+    template_name = 'polls/index.html'
+
+    async def get(self, request):
+        """Render one page of the latest published questions or a search."""
+        # pages only keep the questions published by now themselves
+        questions = Question.objects.with_status()
+        search_query = request.GET.get('q', '').strip()
+        if search_query:
+            # looking up the search index the first time is a sync query
+            matches = await sync_to_async(search_questions)(
+                questions.published(), search_query)
+            page, next_cursor = [
+                question async for question in
+                matches[:settings.POLLS_SEARCH_RESULTS]], None
+        else:
+            try:
+                page, next_cursor = await apage_before(
+                    questions, request.GET.get('before'),
+                    settings.POLLS_INDEX_PAGE_SIZE)
+            except ValueError:
+                raise Http404("Invalid page cursor.")
+        return self.render_to_response({
+            'latest_question_list': page,
+            'next_cursor': next_cursor,
+            'search_query': search_query,
+            'question_list_version':
+                await sync_to_async(question_list_version)(),
+            'status_key': status_key(page),
+        })
+
+
+@method_decorator(async_condition(etag_func=results_etag,
+                                  last_modified_func=results_last_modified),
+                  name='dispatch')
+class AsyncResultsView(generic.base.TemplateResponseMixin, generic.View):
+    """Async version of ResultsView."""
+    template_name = 'polls/results.html'
+
+    async def get(self, request, pk):
+        """Render the aggregated vote totals of the question."""
+        question = await aresults_question(request, pk)
+        if question is None:
+            raise Http404("No question found matching the query.")
+        return self.render_to_response({
+            'question': question,
+            'object': question,
+            'results': await acached_question_results(question),
+        })
+
+
+@async_login_required
+async def avote(request, question_id):
+    """Async version of vote."""
     try:
-        # find a vote for this user and this question
-        vote = Vote.objects.get(user=this_user, choice__question=question)
-        # update his vote
-        vote.choice = selected_choice
-    except Vote.DoesNotExist:
-        # no matching vote - create a new Vote
-        vote = Vote(user=this_user, choice=selected_choice)
+        question = await Question.objects.aget(pk=question_id)
+    except Question.DoesNotExist:
+        raise Http404("No question found matching the query.")
 
-    vote.save()
+    if not question.can_vote():
+        messages.error(request, "This poll does not allow to vote.")
+        return redirect("polls:index")
 
-    messages.success(request, f"Your vote for '{vote.choice}' has been saved.")
+    try:
+        selected_choice = await question.choice_set.aget(
+            pk=request.POST['choice'])
+    except (KeyError, Choice.DoesNotExist):
+        messages.error(request, "Please select choice before submit the vote.")
+        return redirect("polls:detail", pk=question_id)
+
+    if settings.POLLS_VOTE_WRITE_BEHIND and get_vote_queue().submit(
+            request.user.pk, question.pk, selected_choice.pk):
+        messages.success(request, f"Your vote for '{selected_choice}' "
+                                  f"has been received.")
+    else:
+        await Vote.objects.acast(request.user, selected_choice)
+        messages.success(request,
+                         f"Your vote for '{selected_choice}' has been saved.")
 
     return HttpResponseRedirect(
-        reverse('polls:results', args=(question_id,))
+        reverse('polls:async_results', args=(question_id,))
     )
 
 
-def signup(request):
-    """Register a new user."""
+@staff_member_required
+def export_results(request):
+    """
+    Stream the tallies and votes of the questions given by the `question`
+    query parameters, or of every question, as CSV or JSON (`format`).
+    """
+    format = request.GET.get('format', 'csv')
+    if format not in EXPORT_FORMATS:
+        raise Http404("Unknown export format.")
+    try:
+        question_ids = [int(pk) for pk in request.GET.getlist('question')]
+    except ValueError:
+        raise Http404("Invalid question id.")
+    return export_response(request, question_ids or None, format)
+
+
+@staff_member_required
+def metrics(request):
+    """
+    Return the request timings of each view, the vote queue state and the
+    number of results streams.
+    """
+    return JsonResponse({
+        'views': request_metrics.snapshot(),
+        'vote_queue': get_vote_queue().metrics(),
+        'results_streams': get_results_broker().metrics(),
+    })
+
+
+async def signup(request):
+    """
+    Register a new user.
+
+    The password is hashed in a worker thread, so under ASGI the slow hash
+    does not hold up the thread that runs the synchronous views.
+    """
     if request.method == 'POST':
         form = UserCreationForm(request.POST)
-        if form.is_valid():
-            form.save()
-            # get named fields from the form data
-            username = form.cleaned_data.get('username')
-            # password input field is named 'password1'
-            raw_passwd = form.cleaned_data.get('password1')
-            user = authenticate(username=username, password=raw_passwd)
-            login(request, user)
+        if await sync_to_async(form.is_valid)():
+            # save(commit=False) only hashes the password
+            user = await sync_to_async(form.save,
+                                       thread_sensitive=False)(commit=False)
+            await sync_to_async(user.save)()
+            # the password was just set, so log in without checking it again
+            await sync_to_async(login)(
+                request, user,
+                backend='django.contrib.auth.backends.ModelBackend',
+            )
             return redirect('polls:index')
         # what if form is not valid?
         # we should display a message in signup.html
     else:
         # create a user form and display it the signup page
         form = UserCreationForm()
-    return render(request, 'registration/signup.html', {'form': form})
+    return await sync_to_async(render)(request, 'registration/signup.html',
+                                       {'form': form})